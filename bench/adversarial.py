@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Runs the rewriting middlewares over pages built to make a backtracking regex
+take quadratic time (a minified line of anchors without hrefs, link and form
+values that never close their quotes, hs tags that never end, ...) and checks
+that each still takes time linear in the page's length.  Exits 1 if any case
+doesn't.
+
+    python bench/adversarial.py
+    python bench/adversarial.py --sizes 16KB,128KB --only anchor_fix
+
+Each case is timed at two page sizes.  Its time has to grow by no more than
+SLACK times as much as the page did, and the bigger page has to go through at
+MIN_MBPS or better.  A quadratic rewrite blows through both.
+"""
+import sys
+import optparse
+
+import run
+import fixtures
+
+from django.http import HttpResponse
+
+# name -> (start, repeated, end) of a page body, all on one line
+CORPUS = {
+    'anchors_without_hrefs': ('', '<a name="top">', ''),
+    'anchor_hrefs_unclosed': ('', '<a href="/', ''),
+    'anchor_then_hrefs': ('<a ', 'href="/', ''),
+    'anchors_then_newlines': ('', '<a <a\n', ''),
+    'forms_without_actions': ('', '<form method="post">', ''),
+    'form_actions_unclosed': ('', '<form action="/', ''),
+    'form_then_actions': ('<form ', 'action="/', ''),
+    'hs_links_unclosed': ('', '<hs:link ', ''),
+    'hs_heads_unclosed': ('', '<hs:head>', ''),
+    'hs_titles_unclosed': ('', '<hs:title>', ''),
+    'hs_scripts_unclosed': ('', '<hs:script>', ''),
+    'hs_head_of_links': ('<hs:head>', '<hs:link ', '</hs:head>'),
+    'hs_script_of_heads': ('<hs:script>', '<hs:head>', '</hs:script>'),
+    'hs_title_of_scripts': ('<hs:title>', '<hs:script', '</hs:title>'),
+}
+
+BENCHMARKS = ['anchor_fix', 'anchor_fix_streamed', 'mock', 'stack']
+
+SIZES = [64 * fixtures.KB, 512 * fixtures.KB]
+SLACK = 2.0  # linear time is 1x; quadratic would be the size ratio again
+MIN_MBPS = 1.0  # a tag every few bytes is as bad as it gets, at about 2MB/s
+
+STREAM_CHUNK = 8 * fixtures.KB
+
+
+def page(case, size):
+    start, repeated, end = CORPUS[case]
+    body = start + repeated * ((size - len(start) - len(end)) // len(repeated)) + end
+    return '<html><head><title>t</title></head><body>%s</body></html>' % body
+
+
+def bench_anchor_fix_streamed(bench, content):
+    """
+    The anchor fix on a response served from an iterator, rewritten as the
+    chunks go out
+    """
+    def prepare():
+        chunks = [content[i:i + STREAM_CHUNK] for i in xrange(0, len(content), STREAM_CHUNK)]
+        return bench.canvas_request(True), HttpResponse(iter(chunks))
+    def run_once(request, response):
+        run.send(bench.anchor_fix.process_response(request, response))
+    return prepare, run_once
+
+
+def parse_size(name):
+    units = {'KB': fixtures.KB, 'MB': fixtures.MB}
+    return int(name[:-2]) * units[name[-2:].upper()]
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', help='the two page sizes, e.g. 16KB,128KB (default: %s)' %
+                      ','.join(fixtures.human(size) for size in SIZES))
+    parser.add_option('--only', help='comma separated benchmarks (default: %s)' % ','.join(BENCHMARKS))
+    parser.add_option('--cases', help='comma separated cases (default: all)')
+    parser.add_option('--budget', type='float', default=0.2,
+            help='seconds to spend per case and size (default: %default)')
+    options, args = parser.parse_args(argv)
+
+    small, large = SIZES
+    if options.sizes:
+        small, large = [parse_size(name.strip()) for name in options.sizes.split(',')]
+    only = options.only and [name.strip() for name in options.only.split(',')] or BENCHMARKS
+    cases = options.cases and [name.strip() for name in options.cases.split(',')] or sorted(CORPUS)
+    limit = SLACK * large / small
+
+    bench = run.Bench()
+    failed = []
+    print '%-44s %10s %10s %8s %8s %10s' % ('case', 'small ms', 'large ms', 'growth', 'limit', 'MB/s')
+    for case in cases:
+        for benchmark in only:
+            key = '%s/%s' % (benchmark, case)
+            times = []
+            for size in (small, large):
+                content = page(case, size)
+                make = getattr(bench, 'bench_%s' % benchmark, None)
+                if make:
+                    prepare, run_once = make(content)
+                else:
+                    prepare, run_once = globals()['bench_%s' % benchmark](bench, content)
+                times.append(run.percentile(run.measure(prepare, run_once, options.budget), 0.50))
+            growth = times[1] / times[0]
+            mbps = float(large) / times[1] / fixtures.MB
+            verdict = ''
+            if growth > limit or mbps < MIN_MBPS:
+                verdict = '  FAIL'
+                failed.append(key)
+            print '%-44s %10.3f %10.3f %8.1f %8.1f %10.1f%s' % (key, times[0] * 1000,
+                    times[1] * 1000, growth, limit, mbps, verdict)
+            sys.stdout.flush()
+
+    if failed:
+        print '%d case(s) not linear: %s' % (len(failed), ', '.join(failed))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Synthetic canvas pages and requests for the middleware benchmarks
+"""
+import random
+
+KB = 1024
+MB = 1024 * KB
+
+SIZES = [1 * KB, 64 * KB, 1 * MB, 10 * MB, 50 * MB]
+
+# fraction of the body's chunks that are links, forms and hs tags
+DENSITIES = {
+    'sparse': {'anchor': 0.02, 'form': 0.005, 'hs': 0.001},
+    'dense': {'anchor': 0.3, 'form': 0.05, 'hs': 0.02},
+}
+
+HEAD = """<head>
+<style type="text/css">body { font-family: sans-serif; }</style>
+<script type="text/javascript">var started = new Date();</script>
+</head>"""
+
+TEXT = [
+    '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n',
+    '<div class="row"><span class="label">Contacts</span><span>%d</span></div>\n',
+    '<li class="item"><em>Item %d</em> with some <strong>markup</strong></li>\n',
+    '<a name="anchor%d">named anchors have no href</a>\n',
+]
+ANCHORS = [
+    '<a href="/contacts/%d">Contact</a>\n',
+    '<a class="button" id="b%d" href="/reports/%d?page=2">Report</a>\n',
+    '<a href="http://example.com/%d">Offsite</a>\n',
+]
+FORMS = [
+    '<form method="post" action="/save/%d"><input name="q"/></form>\n',
+    '<form class="search" action="http://example.com/%d"></form>\n',
+]
+HS_TAGS = [
+    '<hs:link rel="stylesheet" href="/static/app%d.css"/>\n',
+    '<hs:head><meta name="app" content="%d"/></hs:head>\n',
+    '<hs:title>Page %d</hs:title>\n',
+    '<hs:script type="text/javascript">var page = %d;\n</hs:script>\n',
+]
+
+
+def body(size, density='sparse', minified=False, seed=0):
+    """
+    Generates about size bytes of body markup with the given density of
+    anchors, forms and hs tags, all on one line if minified
+    """
+    rates = DENSITIES[density]
+    rand = random.Random(seed)
+    parts = []
+    total = 0
+    n = 0
+    while total < size:
+        roll = rand.random()
+        if roll < rates['hs']:
+            choices = HS_TAGS
+        elif roll < rates['hs'] + rates['form']:
+            choices = FORMS
+        elif roll < rates['hs'] + rates['form'] + rates['anchor']:
+            choices = ANCHORS
+        else:
+            choices = TEXT
+        part = rand.choice(choices)
+        part = part % ((n,) * part.count('%d'))
+        if minified:
+            part = part.replace('\n', '')
+        parts.append(part)
+        total += len(part)
+        n += 1
+    return ''.join(parts)
+
+
+def page(size, density='sparse', minified=False, seed=0):
+    """
+    Wraps a generated body into a whole page
+    """
+    content = '<html>%s<body>%s</body></html>' % (
+            HEAD, body(size, density, minified, seed))
+    if minified:
+        content = content.replace('\n', '')
+    return content
+
+
+def cases(sizes=SIZES):
+    """
+    Yields a (name, size, density, minified) tuple for every fixture
+    """
+    for size in sizes:
+        for density in sorted(DENSITIES):
+            for minified in (False, True):
+                name = '%s-%s%s' % (
+                        human(size), density, minified and '-min' or '')
+                yield name, size, density, minified
+
+
+def human(size):
+    if size >= MB:
+        return '%dMB' % (size / MB)
+    return '%dKB' % (size / KB)
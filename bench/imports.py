@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Times how long importing the marketplace package takes the way worker
+processes and command line tools do it: each import in a fresh interpreter,
+with no django settings configured.  Reports the median time, how many
+modules got loaded along the way, and whether django came with them.
+
+    python bench/imports.py                    # this checkout
+    python bench/imports.py --compare <rev>    # next to a tag or branch too
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORTS = [
+    ('package', 'import marketplace'),
+    ('request_supplement', 'from marketplace.request_supplement import RequestSupplement'),
+    ('bulk_verify', 'import marketplace.bulk_verify'),
+    ('session_token', 'import marketplace.session_token'),
+    ('auth_middleware', 'from marketplace import AuthMiddleware'),
+]
+
+# run in the fresh interpreter: times the import and reports on what it loaded
+PROBE = """
+import sys, json, timeit
+before = set(sys.modules)
+start = timeit.default_timer()
+exec %r
+elapsed = timeit.default_timer() - start
+loaded = [m for m in set(sys.modules) - before if sys.modules[m] is not None]
+print json.dumps({'seconds': elapsed, 'modules': len(loaded),
+                  'django': 'django.conf' in sys.modules})
+"""
+
+
+def probe(root, statement):
+    env = dict(os.environ)
+    env.pop('DJANGO_SETTINGS_MODULE', None)
+    env['PYTHONPATH'] = root
+    output = subprocess.check_output([sys.executable, '-c', PROBE % statement],
+                                     cwd=root, env=env)
+    return json.loads(output.splitlines()[-1])
+
+
+def measure(root, statement, repeat):
+    """
+    The median of repeat runs, after one to warm the disk cache and write the
+    .pyc files
+    """
+    probe(root, statement)
+    runs = sorted((probe(root, statement) for i in xrange(repeat)),
+                  key=lambda run: run['seconds'])
+    return runs[len(runs) // 2]
+
+
+def export(rev):
+    """
+    Checks rev out into a temporary directory (which the caller removes)
+    """
+    path = tempfile.mkdtemp(prefix='marketplace-imports-')
+    archive = subprocess.Popen(['git', 'archive', rev], cwd=ROOT, stdout=subprocess.PIPE)
+    subprocess.check_call(['tar', '-x', '-C', path], stdin=archive.stdout)
+    if archive.wait():
+        shutil.rmtree(path)
+        raise SystemExit('git archive %s failed' % rev)
+    return path
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--repeat', type='int', default=15,
+            help='fresh interpreters per import (default: %default)')
+    parser.add_option('--compare', metavar='REV',
+            help='also time the imports as of this git revision')
+    options, args = parser.parse_args(argv)
+
+    other = options.compare and export(options.compare)
+    try:
+        print '%-20s %10s %8s %7s%s' % ('import', 'ms', 'modules', 'django',
+                other and '  %s ms (modules)' % options.compare or '')
+        for name, statement in IMPORTS:
+            run = measure(ROOT, statement, options.repeat)
+            versus = ''
+            if other:
+                try:
+                    before = measure(other, statement, options.repeat)
+                except subprocess.CalledProcessError:
+                    versus = '  (fails)'
+                else:
+                    versus = '  %.1f (%d)  %.1fx' % (before['seconds'] * 1000,
+                            before['modules'], before['seconds'] / run['seconds'])
+            print '%-20s %10.1f %8d %7s%s' % (name, run['seconds'] * 1000,
+                    run['modules'], run['django'] and 'yes' or 'no', versus)
+    finally:
+        if other:
+            shutil.rmtree(other)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
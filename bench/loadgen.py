@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Load tests a locally running app's marketplace paths without the marketplace.
+Builds signed marketplace requests the way the MockMiddleware would (the same
+hubspot.marketplace.* params and signatures), spread over many hub ids, user
+ids and canvas paths, and fires them at the app from a pool of keep-alive
+connections.  Reports throughput, latency percentiles and response statuses.
+
+    python bench/loadgen.py --secret yoursecret --slug yourslug \\
+            --url http://localhost:8000 --requests 10000 --concurrency 16
+
+Leave off --secret and --slug to pick up the marketplace settings from
+DJANGO_SETTINGS_MODULE instead.
+"""
+import os
+import sys
+import time
+import random
+import urllib
+import httplib
+import urlparse
+import threading
+import optparse
+import collections
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def configure(options):
+    from django.conf import settings
+    if options.secret or options.slug or not os.environ.get('DJANGO_SETTINGS_MODULE'):
+        settings.configure(
+            HUBSPOT_MARKETPLACE_AUTH={'secret_key': options.secret or 'bench-secret-key'},
+            HUBSPOT_MARKETPLACE_MOCK={
+                'slug': options.slug or 'benchapp',
+                'app': {'name': 'Load', 'callback_url': options.url},
+            },
+        )
+    from marketplace.middleware.mock import MockMiddleware
+    return MockMiddleware()
+
+
+class RequestBuilder(object):
+    """
+    Builds a pool of signed marketplace requests up front (signing isn't free,
+    and the generator shouldn't be what's being measured), each one a
+    (method, path, body, headers) tuple ready to send
+    """
+
+    def __init__(self, mock, url, paths, hubs, users, method='GET', seed=0):
+        super(RequestBuilder,self).__init__()
+        self.mock = mock
+        parsed = urlparse.urlparse(url)
+        self.host = parsed.netloc
+        self.prefix = parsed.path.rstrip('/')
+        self.paths = paths
+        self.hubs = hubs
+        self.users = users
+        self.method = method
+        self.rand = random.Random(seed)
+
+    def build(self, count):
+        return [self.build_one() for i in xrange(count)]
+
+    def build_one(self):
+        rand = self.rand
+        hub_id = rand.choice(self.hubs)
+        user_id = rand.choice(self.users)
+        path = rand.choice(self.paths)
+        base = dict(self.mock.base)
+        base['hubspot.marketplace.user_id'] = str(user_id)
+        base['hubspot.marketplace.signature'] = self.mock.sign(
+                '%s:%s:%s' % (hub_id, user_id, rand.getrandbits(32)))
+        canvas_path = '/market/%s/canvas/%s%s' % (hub_id, self.mock.slug, path)
+        params = urllib.urlencode(self.mock.marketplace_params(
+                hub_id, self.host, canvas_path, base))
+        headers = {'Host': self.host}
+        if self.method == 'POST':
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            return self.method, self.prefix + path, params, headers
+        joiner = '?' in path and '&' or '?'
+        return self.method, self.prefix + path + joiner + params, None, headers
+
+
+class LoadGenerator(object):
+    """
+    Sends the requests from a number of threads, each holding one keep-alive
+    connection (reconnecting after any error), and keeps every latency
+    """
+
+    def __init__(self, url, requests, concurrency, timeout=30):
+        super(LoadGenerator,self).__init__()
+        parsed = urlparse.urlparse(url)
+        self.connection_class = parsed.scheme == 'https' and httplib.HTTPSConnection or httplib.HTTPConnection
+        self.netloc = parsed.netloc
+        self.requests = requests
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.taken = 0
+        self.latencies = []
+        self.statuses = collections.defaultdict(int)
+
+    def take(self):
+        with self.lock:
+            if self.taken >= len(self.requests):
+                return None
+            self.taken += 1
+            return self.requests[self.taken - 1]
+
+    def worker(self):
+        timer = time.time
+        connection = None
+        latencies = []
+        statuses = collections.defaultdict(int)
+        while True:
+            request = self.take()
+            if request is None:
+                break
+            method, path, body, headers = request
+            start = timer()
+            try:
+                if connection is None:
+                    connection = self.connection_class(self.netloc, timeout=self.timeout)
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+                if response.getheader('connection', '').lower() == 'close':
+                    connection.close()
+                    connection = None
+            except (httplib.HTTPException, IOError), e:
+                status = e.__class__.__name__
+                if connection is not None:
+                    connection.close()
+                connection = None
+            latencies.append(timer() - start)
+            statuses[status] += 1
+        if connection is not None:
+            connection.close()
+        with self.lock:
+            self.latencies.extend(latencies)
+            for status, count in statuses.iteritems():
+                self.statuses[status] += count
+
+    def run(self):
+        threads = [threading.Thread(target=self.worker) for i in xrange(self.concurrency)]
+        start = time.time()
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)  # so ^C still gets through
+        return time.time() - start
+
+
+def percentile(latencies, p):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+def id_range(spec):
+    """
+    '1000-1099' or '1000,1005' to a list of ids
+    """
+    ids = []
+    for part in spec.split(','):
+        if '-' in part:
+            low, high = part.split('-', 1)
+            ids.extend(xrange(int(low), int(high) + 1))
+        else:
+            ids.append(int(part))
+    return ids
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--url', default='http://localhost:8000',
+            help="the app's callback url (default: %default)")
+    parser.add_option('--secret', help='secret to sign with (default: from settings)')
+    parser.add_option('--slug', help='app slug (default: from settings)')
+    parser.add_option('--paths', default='/',
+            help='comma separated canvas paths (default: %default)')
+    parser.add_option('--hubs', default='1000-1999', help='hub ids (default: %default)')
+    parser.add_option('--users', default='1-10000', help='user ids (default: %default)')
+    parser.add_option('--method', default='GET', choices=['GET', 'POST'])
+    parser.add_option('--requests', type='int', default=10000,
+            help='requests to send (default: %default)')
+    parser.add_option('--variants', type='int', default=1000,
+            help='distinct signed requests to cycle through (default: %default)')
+    parser.add_option('--concurrency', type='int', default=8,
+            help='connections in flight (default: %default)')
+    parser.add_option('--timeout', type='float', default=30.0,
+            help='seconds per request (default: %default)')
+    parser.add_option('--seed', type='int', default=0)
+    options, args = parser.parse_args(argv)
+
+    mock = configure(options)
+    builder = RequestBuilder(mock, options.url,
+            [path.strip() for path in options.paths.split(',')],
+            id_range(options.hubs), id_range(options.users),
+            options.method, options.seed)
+    variants = builder.build(min(options.variants, options.requests))
+    requests = [variants[i % len(variants)] for i in xrange(options.requests)]
+
+    generator = LoadGenerator(options.url, requests, options.concurrency, options.timeout)
+    elapsed = generator.run()
+    latencies = sorted(generator.latencies)
+    if not latencies:
+        print 'no requests sent'
+        return 1
+
+    print '%d requests in %.2fs over %d connections: %.1f req/s' % (
+            len(latencies), elapsed, options.concurrency, len(latencies) / elapsed)
+    print 'latency ms  p50 %.2f  p90 %.2f  p99 %.2f  max %.2f' % tuple(
+            [percentile(latencies, p) * 1000 for p in (0.50, 0.90, 0.99)] + [latencies[-1] * 1000])
+    for status in sorted(generator.statuses):
+        print '%8s %d' % (status, generator.statuses[status])
+    failed = sum(count for status, count in generator.statuses.iteritems()
+                 if not isinstance(status, int) or status >= 500)
+    return failed and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Checks that rewriting a page never needs more than a small multiple of the
+page's size in extra memory, for each rewriting middleware on its own and for
+the whole stack.  Exits 1 if any case goes over its limit.
+
+    python bench/memory.py
+    python bench/memory.py --sizes 1MB,10MB,50MB --only stack
+
+Peak memory is traced with tracemalloc where there is one, and otherwise
+measured as the peak resident size of a forked child (see bench/run.py).
+Since the rewritten page has to be held somewhere, 1x is the floor.
+"""
+import sys
+import optparse
+
+import run
+import fixtures
+
+# the most extra memory, as a multiple of the page's size, each may peak at
+LIMITS = {
+    'mock': 1.5,
+    'anchor_fix': 1.5,
+    'error_goggles': 1.5,
+    'stack': 3.0,
+}
+
+SIZES = [1 * fixtures.MB, 10 * fixtures.MB]
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', help='comma separated, e.g. 1MB,10MB (default: %s)' %
+                      ','.join(fixtures.human(size) for size in SIZES))
+    parser.add_option('--only', help='comma separated benchmarks (default: %s)' % ','.join(sorted(LIMITS)))
+    options, args = parser.parse_args(argv)
+
+    sizes = SIZES
+    if options.sizes:
+        by_name = dict((fixtures.human(size), size) for size in fixtures.SIZES)
+        sizes = [by_name[name.strip()] for name in options.sizes.split(',')]
+    only = options.only and [name.strip() for name in options.only.split(',')] or sorted(LIMITS)
+
+    bench = run.Bench()
+    over = []
+    print '%-34s %10s %10s %8s %8s' % ('case', 'page MB', 'peak MB', 'ratio', 'limit')
+    for name, size, density, minified in fixtures.cases(sizes):
+        content = fixtures.page(size, density, minified)
+        for benchmark in only:
+            key = '%s/%s' % (benchmark, name)
+            prepare, run_once = getattr(bench, 'bench_%s' % benchmark)(content)
+            peak = run.peak_memory(prepare, run_once)
+            if peak is None:
+                print 'no way to measure peak memory on this platform'
+                return 0
+            ratio = float(peak) / len(content)
+            verdict = ''
+            if ratio > LIMITS[benchmark]:
+                verdict = '  OVER'
+                over.append(key)
+            print '%-34s %10.1f %10.1f %8.2f %8.2f%s' % (key, float(len(content)) / fixtures.MB,
+                    float(peak) / fixtures.MB, ratio, LIMITS[benchmark], verdict)
+            sys.stdout.flush()
+
+    if over:
+        print '%d case(s) over their limit: %s' % (len(over), ', '.join(over))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
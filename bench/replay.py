@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Replays a marketplace capture log (see marketplace.capture) through your app's
+middlewares, urls and views, offline, and reports how long each path took.
+Run it against your own project's settings, so that the same middlewares and
+views get exercised:
+
+    DJANGO_SETTINGS_MODULE=yourproject.settings python bench/replay.py capture.log
+    ... --save before.json                # store per-path timings
+    ... --compare before.json             # compare against them after a change
+
+Captured signatures don't keep their digests, so every request gets re-signed
+with the secret in your settings.
+"""
+import os
+import sys
+import json
+import base64
+import urllib
+import timeit
+import optparse
+import collections
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SIGNATURE_KEY = 'hubspot.marketplace.signature'
+PADDING_KEY = 'replay.padding'
+
+
+def encode(s):
+    return base64.urlsafe_b64encode(s).split('=', 1)[0]
+
+
+def decode(s):
+    return base64.urlsafe_b64decode(str(s) + '=' * (4 - len(s) % 4))
+
+
+def utf8(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+
+class Replayer(object):
+    """
+    Turns capture log entries back into signed requests and runs them through
+    the django test client (which runs the whole middleware chain and view)
+    """
+
+    def __init__(self):
+        super(Replayer,self).__init__()
+        from django.test.client import Client
+        from marketplace import conf
+        self.client = Client()
+        self.secrets = conf.get().secrets
+
+    def params(self, entry):
+        """
+        The entry's params, re-signed, with the keys and values (which come
+        out of the log as unicode) encoded to utf-8 for urlencode
+        """
+        params = [(utf8(k), utf8(v)) for k, v in entry['q']]
+        digest = self.secrets.sign(decode(entry['s']), self.secrets.slug_for_path(entry['p']))
+        params.append((SIGNATURE_KEY, '%s.%s' % (encode(digest or ''), entry['s'])))
+        return params
+
+    def replay(self, entry):
+        """
+        Returns the response's status code, or the name of the exception the
+        view raised
+        """
+        params = self.params(entry)
+        try:
+            if entry['m'] == 'POST':
+                body = urllib.urlencode(params)
+                short = entry.get('b', 0) - len(body) - len(PADDING_KEY) - 2
+                if short > 0:
+                    body += '&%s=%s' % (PADDING_KEY, 'x' * short)
+                response = self.client.post(entry['p'], body,
+                        content_type='application/x-www-form-urlencoded')
+            else:
+                response = self.client.get(entry['p'], params)
+            for chunk in response:
+                pass
+            return response.status_code
+        except Exception, e:
+            return e.__class__.__name__
+
+
+def percentile(latencies, p):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] CAPTURE_LOG')
+    parser.add_option('--repeat', type='int', default=1,
+            help='times to run through the log (default: %default)')
+    parser.add_option('--limit', type='int', help='only replay the first LIMIT entries')
+    parser.add_option('--top', type='int', default=20,
+            help='paths to report on, busiest first (default: %default)')
+    parser.add_option('--save', help='store per-path timings as json')
+    parser.add_option('--compare', help='compare against timings stored with --save')
+    parser.add_option('--tolerance', type='float', default=0.25,
+            help='allowed p50 slowdown vs --compare (default: %default)')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('which capture log?')
+    if not os.environ.get('DJANGO_SETTINGS_MODULE'):
+        parser.error('set DJANGO_SETTINGS_MODULE to your project\'s settings')
+
+    from marketplace import capture
+    entries = list(capture.read(args[0]))[:options.limit]
+    if not entries:
+        print 'nothing to replay'
+        return 1
+
+    replayer = Replayer()
+    timer = timeit.default_timer
+    latencies = collections.defaultdict(list)
+    statuses = collections.defaultdict(int)
+    start = timer()
+    for i in xrange(options.repeat):
+        for entry in entries:
+            began = timer()
+            status = replayer.replay(entry)
+            latencies[entry['p']].append(timer() - began)
+            statuses[status] += 1
+    elapsed = timer() - start
+
+    total = sum(len(l) for l in latencies.itervalues())
+    print '%d requests in %.2fs: %.1f req/s' % (total, elapsed, total / elapsed)
+    for status in sorted(statuses):
+        print '%8s %d' % (status, statuses[status])
+    print
+
+    baselines = options.compare and json.load(open(options.compare)) or {}
+    results = {}
+    regressions = []
+    print '%-50s %8s %10s %10s  %s' % ('path', 'count', 'p50 ms', 'p99 ms', 'vs baseline')
+    busiest = sorted(latencies, key=lambda path: -len(latencies[path]))
+    for path in busiest:
+        times = sorted(latencies[path])
+        results[path] = {'count': len(times), 'p50': percentile(times, 0.50),
+                         'p99': percentile(times, 0.99)}
+        versus = ''
+        if path in baselines:
+            change = results[path]['p50'] / baselines[path]['p50'] - 1
+            versus = '%+.0f%%' % (change * 100)
+            if change > options.tolerance:
+                versus += '  REGRESSION'
+                regressions.append(path)
+        if path in busiest[:options.top] or path in regressions:
+            print '%-50s %8d %10.3f %10.3f  %s' % (path[:50], len(times),
+                    results[path]['p50'] * 1000, results[path]['p99'] * 1000, versus)
+
+    if options.save:
+        json.dump(results, open(options.save, 'w'), indent=2, sort_keys=True)
+        print 'saved timings to %s' % options.save
+    if regressions:
+        print '%d regression(s)' % len(regressions)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
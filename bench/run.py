@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+"""
+Benchmarks the marketplace middlewares against synthetic canvas pages, each
+middleware on its own and the whole stack in settings order, without running
+a server.  Reports throughput, p50/p99 latency and peak memory, and compares
+the p50s against stored baselines.
+
+    python bench/run.py                       # compare against the baselines
+    python bench/run.py --save                # store new baselines
+    python bench/run.py --sizes 1KB,1MB --only anchor_fix,stack
+
+With --check it times nothing, and instead checks that each rewriting
+benchmark's output for each fixture page still hashes the same as the known
+good rendering stored in bench/outputs.json (recorded from the middlewares as
+they were before any of the rewriting got optimized), exiting 1 if any
+doesn't:
+
+    python bench/run.py --check
+    python bench/run.py --check --save-outputs   # only when a change is meant
+"""
+import os
+import sys
+import json
+import hashlib
+import timeit
+import optparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from django.conf import settings
+
+STACK = [
+    'marketplace.middleware.mock.MockMiddleware',
+    'marketplace.middleware.auth.AuthMiddleware',
+    'marketplace.middleware.anchor_fix.AnchorFixMiddleware',
+    'marketplace.middleware.error_goggles.ErrorGogglesMiddleware',
+]
+
+SLUG = 'benchapp'
+HUB_ID = 12345
+
+if not settings.configured:
+    settings.configure(
+        DEBUG=True,
+        MIDDLEWARE_CLASSES=STACK,
+        HUBSPOT_MARKETPLACE_AUTH={'secret_key': 'bench-secret-key'},
+        HUBSPOT_MARKETPLACE_MOCK={
+            'slug': SLUG,
+            'app': {'name': 'Bench', 'callback_url': 'http://localhost:8000'},
+        },
+    )
+
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.utils.importlib import import_module
+
+import fixtures
+
+M_MMAP_THRESHOLD = -3  # from malloc.h
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+OUTPUTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'outputs.json')
+CANVAS_PATH = '/market/%s/canvas/%s/contacts' % (HUB_ID, SLUG)
+
+
+def load(path):
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)()
+
+
+def send(response):
+    """
+    Reads the response out the way the server would, which is when any
+    rewriting that has been put off actually happens, and hands it back
+    """
+    for chunk in response:
+        pass
+    return response
+
+
+class Bench(object):
+    """
+    Builds fresh request/response pairs for each iteration (untimed), and
+    runs the part under test against them (timed)
+    """
+
+    def __init__(self):
+        super(Bench,self).__init__()
+        self.factory = RequestFactory()
+        self.stack = [load(path) for path in STACK]
+        self.mock, self.auth, self.anchor_fix, self.error_goggles = self.stack
+
+    def canvas_request(self, authenticate=False):
+        request = self.factory.get(CANVAS_PATH, {'q': 'contacts'})
+        if authenticate:
+            self.mock.process_request(request)
+            self.auth.process_request(request)
+        return request
+
+    # each benchmark returns a (prepare, run) pair; prepare builds the args
+    # for one run
+
+    def bench_mock(self, content):
+        def prepare():
+            request = self.canvas_request()
+            request.marketplace = self.canvas_request(True).marketplace
+            return request, HttpResponse(content)
+        def run(request, response):
+            self.mock.process_request(request)
+            return send(self.mock.process_response(request, response))
+        return prepare, run
+
+    def bench_auth(self, content):
+        def prepare():
+            request = self.canvas_request()
+            self.mock.process_request(request)
+            return request,
+        return prepare, self.auth.process_request
+
+    def bench_auth_params(self, content):
+        """
+        The auth on a request that carries lots of params besides the
+        marketplace's (a big form, say), none of which a cached signature
+        should need to look through
+        """
+        params = dict(('field%d' % i, 'value') for i in xrange(EXTRA_PARAMS))
+        def prepare():
+            request = self.factory.get(CANVAS_PATH, params)
+            self.mock.process_request(request)
+            return request,
+        return prepare, self.auth.process_request
+
+    def bench_anchor_fix(self, content):
+        def prepare():
+            return self.canvas_request(True), HttpResponse(content)
+        def run(request, response):
+            return send(self.anchor_fix.process_response(request, response))
+        return prepare, run
+
+    def bench_error_goggles(self, content):
+        def prepare():
+            return self.canvas_request(True), HttpResponse(content, status=500)
+        def run(request, response):
+            return send(self.error_goggles.process_response(request, response))
+        return prepare, run
+
+    def bench_stack(self, content):
+        def prepare():
+            return self.canvas_request(),
+        def run(request):
+            for middleware in self.stack:
+                if hasattr(middleware, 'process_request'):
+                    middleware.process_request(request)
+            response = HttpResponse(content)
+            for middleware in reversed(self.stack):
+                if hasattr(middleware, 'process_response'):
+                    response = middleware.process_response(request, response)
+            return send(response)
+        return prepare, run
+
+BENCHMARKS = ['mock', 'auth', 'auth_params', 'anchor_fix', 'error_goggles', 'stack']
+BODYLESS = ['auth', 'auth_params']  # don't look at the body, so only run once per density
+EXTRA_PARAMS = 500  # non-marketplace params on the auth_params requests
+
+
+def measure(prepare, run, budget, min_runs=3, max_runs=500):
+    """
+    Runs until the time budget is spent (but at least min_runs times), and
+    returns the sorted latencies in seconds
+    """
+    timer = timeit.default_timer
+    latencies = []
+    spent = 0.0
+    while len(latencies) < max_runs and (len(latencies) < min_runs or spent < budget):
+        args = prepare()
+        start = timer()
+        run(*args)
+        latencies.append(timer() - start)
+        spent += latencies[-1]
+    return sorted(latencies)
+
+
+def peak_memory(prepare, run):
+    """
+    Returns the peak memory (in bytes) allocated by one run, or None if there
+    is no way to tell on this platform
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return forked_peak_memory(prepare, run)
+    args = prepare()
+    tracemalloc.start()
+    try:
+        run(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def forked_peak_memory(prepare, run):
+    """
+    Without tracemalloc, runs once in a child process and reports how far its
+    resident size peaked above where it started
+    """
+    try:
+        fork = os.fork
+    except AttributeError:
+        return None
+    args = prepare()
+    read_end, write_end = os.pipe()
+    pid = fork()
+    if not pid:
+        os.close(read_end)
+        try:
+            untouch_free_memory()
+            before = resident_size()
+            run(*args)
+            os.write(write_end, str(max(0, peak_resident_size() - before)))
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    result = os.read(read_end, 64)
+    os.close(read_end)
+    os.waitpid(pid, 0)
+    return result and int(result) or None
+
+
+def untouch_free_memory():
+    """
+    Has glibc hand the free heap it inherited back to the system, and give
+    every big allocation its own mapping from here on.  Otherwise reused heap
+    the parent already touched wouldn't show up in the resident size at all.
+    """
+    try:
+        import ctypes
+        libc = ctypes.CDLL('libc.so.6')
+        libc.mallopt(M_MMAP_THRESHOLD, 64 * 1024)
+        libc.malloc_trim(0)
+    except (ImportError, OSError, AttributeError):
+        pass
+
+
+def resident_size():
+    """
+    Current resident size in bytes, resetting the peak to it where linux lets
+    us (a forked child otherwise inherits its parent's peak)
+    """
+    try:
+        open('/proc/self/clear_refs', 'w').write('5')
+    except IOError:
+        pass
+    return proc_status('VmRSS')
+
+
+def peak_resident_size():
+    peak = proc_status('VmHWM')
+    if peak is None:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return peak
+
+
+def proc_status(field):
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024  # reported in kB
+    except IOError:
+        pass
+    return None
+
+
+def check_outputs(bench, sizes, only, path, save=False):
+    """
+    Compares the md5 of what each benchmark that rewrites pages puts out for
+    each fixture against the ones stored at path (or stores them, if save),
+    returning the cases that differ or have nothing to compare against
+    """
+    expected = {}
+    if os.path.exists(path):
+        expected = json.load(open(path))
+    outputs = {}
+    mismatches = []
+    print '%-34s %34s  %s' % ('case', 'md5', 'vs expected')
+    for name, size, density, minified in fixtures.cases(sizes):
+        content = fixtures.page(size, density, minified)
+        for benchmark in only:
+            if benchmark in BODYLESS:
+                continue
+            key = '%s/%s' % (benchmark, name)
+            prepare, run = getattr(bench, 'bench_%s' % benchmark)(content)
+            digest = outputs[key] = hashlib.md5(run(*prepare()).content).hexdigest()
+            versus = 'same'
+            if expected.get(key) != digest:
+                versus = key in expected and 'DIFFERENT' or 'missing'
+                mismatches.append(key)
+            print '%-34s %34s  %s' % (key, digest, versus)
+            sys.stdout.flush()
+    if save:
+        expected.update(outputs)
+        json.dump(expected, open(path, 'w'), indent=2, sort_keys=True)
+        print 'saved outputs to %s' % path
+        return []
+    return mismatches
+
+
+def percentile(latencies, p):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', help='comma separated, e.g. 1KB,1MB (default: all)')
+    parser.add_option('--only', help='comma separated benchmarks (default: %s)' % ','.join(BENCHMARKS))
+    parser.add_option('--budget', type='float', default=1.0,
+            help='seconds to spend per case (default: %default)')
+    parser.add_option('--tolerance', type='float', default=0.25,
+            help='allowed p50 slowdown vs baseline (default: %default)')
+    parser.add_option('--baselines', default=BASELINES)
+    parser.add_option('--save', action='store_true', help='store the results as the new baselines')
+    parser.add_option('--no-memory', action='store_true', help='skip peak memory measurement')
+    parser.add_option('--cache', type='int', metavar='BYTES',
+            help='turn on the rewrite result cache with this many bytes')
+    parser.add_option('--check', action='store_true',
+            help='check the outputs against the known good ones instead of timing')
+    parser.add_option('--outputs', default=OUTPUTS)
+    parser.add_option('--save-outputs', action='store_true',
+            help='with --check, store the outputs as the known good ones')
+    options, args = parser.parse_args(argv)
+
+    sizes = fixtures.SIZES
+    if options.sizes:
+        by_name = dict((fixtures.human(size), size) for size in fixtures.SIZES)
+        sizes = [by_name[name.strip()] for name in options.sizes.split(',')]
+    only = options.only and [name.strip() for name in options.only.split(',')] or BENCHMARKS
+
+    baselines = {}
+    if os.path.exists(options.baselines):
+        baselines = json.load(open(options.baselines))
+
+    if options.cache:
+        from marketplace import conf
+        settings.HUBSPOT_MARKETPLACE_REWRITE_CACHE = {'max_bytes': options.cache}
+        conf.reset()
+    bench = Bench()
+    if options.check:
+        mismatches = check_outputs(bench, sizes, only, options.outputs, options.save_outputs)
+        if mismatches:
+            print '%d output(s) not as expected: %s' % (len(mismatches), ', '.join(mismatches))
+            return 1
+        return 0
+
+    results = {}
+    regressions = []
+    print '%-34s %10s %10s %10s %10s  %s' % ('case', 'MB/s', 'p50 ms', 'p99 ms', 'peak MB', 'vs baseline')
+    for name, size, density, minified in fixtures.cases(sizes):
+        content = fixtures.page(size, density, minified)
+        for benchmark in only:
+            if benchmark in BODYLESS and size != sizes[0]:
+                continue
+            key = '%s/%s' % (benchmark, name)
+            prepare, run = getattr(bench, 'bench_%s' % benchmark)(content)
+            latencies = measure(prepare, run, options.budget)
+            mean = sum(latencies) / len(latencies)
+            result = {
+                'mbps': benchmark not in BODYLESS and len(content) / mean / fixtures.MB or None,
+                'p50': percentile(latencies, 0.50),
+                'p99': percentile(latencies, 0.99),
+                'peak': None if options.no_memory else peak_memory(prepare, run),
+            }
+            results[key] = result
+
+            versus = ''
+            baseline = baselines.get(key)
+            if baseline:
+                change = result['p50'] / baseline['p50'] - 1
+                versus = '%+.0f%%' % (change * 100)
+                if change > options.tolerance:
+                    versus += '  REGRESSION'
+                    regressions.append(key)
+            peak = result['peak'] is None and 'n/a' or '%.1f' % (float(result['peak']) / fixtures.MB)
+            mbps = result['mbps'] is None and 'n/a' or '%.1f' % result['mbps']
+            print '%-34s %10s %10.3f %10.3f %10s  %s' % (key, mbps,
+                    result['p50'] * 1000, result['p99'] * 1000, peak, versus)
+            sys.stdout.flush()
+
+    if options.save:
+        baselines.update(results)
+        json.dump(baselines, open(options.baselines, 'w'), indent=2, sort_keys=True)
+        print 'saved baselines to %s' % options.baselines
+    if regressions:
+        print '%d regression(s): %s' % (len(regressions), ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
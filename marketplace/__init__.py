@@ -1,6 +1,48 @@
-from request_supplement import RequestSupplement
-from middleware.auth import AuthMiddleware
-from middleware.mock import MockMiddleware
-from middleware.anchor_fix import AnchorFixMiddleware
-from middleware.error_goggles import ErrorGogglesMiddleware
-from middleware.debug_mode_logging import DebugModeLoggingMiddleware
+"""
+The marketplace package hands out RequestSupplement and the middlewares by
+name, but only imports each one the first time it's asked for, so importing
+the package (or just one of its modules, like marketplace.bulk_verify in a
+worker process) doesn't drag django and all the middlewares in with it.
+
+    from marketplace import AuthMiddleware  # imports marketplace.middleware.auth
+"""
+import sys
+from types import ModuleType
+
+# public name -> module it lives in
+EXPORTS = {
+    'RequestSupplement': 'marketplace.request_supplement',
+    'AuthMiddleware': 'marketplace.middleware.auth',
+    'MockMiddleware': 'marketplace.middleware.mock',
+    'AnchorFixMiddleware': 'marketplace.middleware.anchor_fix',
+    'ErrorGogglesMiddleware': 'marketplace.middleware.error_goggles',
+    'DebugModeLoggingMiddleware': 'marketplace.middleware.debug_mode_logging',
+}
+
+__all__ = sorted(EXPORTS)
+
+
+class LazyPackage(ModuleType):
+    """
+    Stands in for the package in sys.modules, importing each of the EXPORTS
+    the first time it's looked up (after which it's a plain attribute)
+    """
+
+    def __getattr__(self, name):
+        module = EXPORTS.get(name)
+        if module is None:
+            raise AttributeError("'module' object has no attribute '%s'" % name)
+        value = getattr(__import__(module, {}, {}, [name]), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(EXPORTS))
+
+
+_package = LazyPackage(__name__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+# python 2 empties a module's globals once the module itself is gone, and
+# LazyPackage's methods still look things up in them
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
@@ -0,0 +1,208 @@
+"""
+Checks marketplace signatures in bulk (from audit logs, say) against your
+secrets, across a pool of processes, without needing any django settings.
+
+    python -m marketplace.bulk_verify --secret yoursecret signatures.log
+    python -m marketplace.bulk_verify --secret new --secret old \\
+            --app otherslug=othersecret --processes 8 --failures bad.txt -
+
+Each line of the input holds a signature, optionally preceded by the slug of
+the app it's for (whitespace separated).  Prints throughput and how many
+passed, failed, or weren't signatures at all, and exits 1 if any didn't pass.
+
+From code:
+
+    verifier = BulkVerifier({'secret_key': 'yoursecret'}, processes=4)
+    summary = verifier.run(open('signatures.log'))
+"""
+import sys
+import time
+import optparse
+import itertools
+import collections
+import multiprocessing
+
+from marketplace.secret_index import SecretIndex
+
+PASSED, PREVIOUS_KEY, FAILED, MALFORMED = 'passed', 'previous_key', 'failed', 'malformed'
+
+
+def parse(line):
+    """
+    Returns the (slug, signature) on a line, or None for a blank line
+    """
+    fields = line.split()
+    if not fields:
+        return None
+    return len(fields) > 1 and fields[-2] or None, fields[-1]
+
+
+def check_chunk(secrets, start, lines):
+    """
+    Checks the lines (the first of which is line number start), returning the
+    counts and a (line number, outcome) for each one that didn't pass
+    """
+    counts = dict.fromkeys((PASSED, PREVIOUS_KEY, FAILED, MALFORMED), 0)
+    failures = []
+    for lineno, line in enumerate(lines, start):
+        parsed = parse(line)
+        if parsed is None:
+            continue
+        slug, signature = parsed
+        try:
+            key = secrets.verify(signature, slug)
+        except TypeError:
+            outcome = MALFORMED
+        else:
+            outcome = key is None and FAILED or PASSED
+            if key:
+                counts[PREVIOUS_KEY] += 1
+        counts[outcome] += 1
+        if outcome != PASSED:
+            failures.append((lineno, outcome))
+    return counts, failures
+
+
+_secrets = None  # each worker process's SecretIndex
+
+
+def _init_worker(auth):
+    global _secrets
+    _secrets = SecretIndex(auth)
+
+
+def _check_chunk(args):
+    return check_chunk(_secrets, *args)
+
+
+class Summary(object):
+    """
+    Running totals for a batch
+    """
+
+    def __init__(self):
+        super(Summary,self).__init__()
+        self.counts = collections.defaultdict(int)
+        self.elapsed = 0.0
+
+    def add(self, counts):
+        for outcome, count in counts.iteritems():
+            self.counts[outcome] += count
+
+    @property
+    def total(self):
+        return self.counts[PASSED] + self.counts[FAILED] + self.counts[MALFORMED]
+
+    @property
+    def rate(self):
+        return self.elapsed and self.total / self.elapsed or 0.0
+
+    def report(self, processes):
+        return '\n'.join([
+            '%d signatures in %.2fs (%d/s) over %d process%s' % (
+                self.total, self.elapsed, self.rate, processes, processes != 1 and 'es' or ''),
+            '%-10s %10d  (%d on a previous key)' % (PASSED, self.counts[PASSED], self.counts[PREVIOUS_KEY]),
+            '%-10s %10d' % (FAILED, self.counts[FAILED]),
+            '%-10s %10d' % (MALFORMED, self.counts[MALFORMED]),
+        ])
+
+
+class BulkVerifier(object):
+    """
+    Streams lines through a pool of processes a chunk at a time, never reading
+    more than a few chunks per process ahead of the checking
+    """
+
+    def __init__(self, auth, processes=None, chunk_size=10000):
+        super(BulkVerifier,self).__init__()
+        self.auth = auth
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+
+    def chunks(self, lines):
+        lines = iter(lines)
+        start = 1
+        while True:
+            chunk = list(itertools.islice(lines, self.chunk_size))
+            if not chunk:
+                return
+            yield start, chunk
+            start += len(chunk)
+
+    def run(self, lines, on_failure=None):
+        """
+        Checks every line, calling on_failure(line number, outcome) for each
+        one that doesn't pass, and returns the Summary
+        """
+        summary = Summary()
+        began = time.time()
+        for counts, failures in self.results(lines):
+            summary.add(counts)
+            if on_failure is not None:
+                for lineno, outcome in failures:
+                    on_failure(lineno, outcome)
+        summary.elapsed = time.time() - began
+        return summary
+
+    def results(self, lines):
+        if self.processes == 1:
+            secrets = SecretIndex(self.auth)
+            for start, chunk in self.chunks(lines):
+                yield check_chunk(secrets, start, chunk)
+            return
+        pool = multiprocessing.Pool(self.processes, _init_worker, (self.auth,))
+        try:
+            pending = collections.deque()
+            for args in self.chunks(lines):
+                pending.append(pool.apply_async(_check_chunk, (args,)))
+                if len(pending) >= self.processes * 2:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] FILE (or - for stdin)')
+    parser.add_option('--secret', action='append', default=[],
+            help='the current secret, then any previous ones (repeatable)')
+    parser.add_option('--app', action='append', default=[], metavar='SLUG=SECRET',
+            help="an app's secret (repeat a slug for its previous secrets)")
+    parser.add_option('--processes', type='int', help='default: one per cpu')
+    parser.add_option('--chunk-size', type='int', default=10000,
+            help='signatures per task (default: %default)')
+    parser.add_option('--failures', help='write the line number and outcome of each failure here')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('which file?')
+
+    auth = {'apps': {}}
+    if options.secret:
+        auth['secret_key'] = options.secret[0]
+        auth['previous_secret_keys'] = options.secret[1:]
+    for app in options.app:
+        slug, _, secret = app.partition('=')
+        keys = auth['apps'].setdefault(slug, {'secret_key': None, 'previous_secret_keys': []})
+        if keys['secret_key'] is None:
+            keys['secret_key'] = secret
+        else:
+            keys['previous_secret_keys'].append(secret)
+    if not SecretIndex(auth):
+        parser.error('give at least one --secret or --app')
+
+    lines = args[0] == '-' and sys.stdin or open(args[0])
+    failures = options.failures and open(options.failures, 'w')
+    on_failure = failures and (lambda lineno, outcome: failures.write('%d %s\n' % (lineno, outcome)))
+    verifier = BulkVerifier(auth, options.processes, options.chunk_size)
+    summary = verifier.run(lines, on_failure)
+    if failures:
+        failures.close()
+    print summary.report(verifier.processes)
+    return summary.counts[FAILED] + summary.counts[MALFORMED] and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Append-only log of authenticated marketplace requests, for replaying real
+traffic offline (see bench/replay.py).
+
+One JSON object per line:
+
+    {"t": 1318000000.25, "m": "GET", "p": "/contacts",
+     "q": [["hubspot.marketplace.portal_id", "123"], ...],
+     "s": "<signature payload>", "b": 0}
+
+The signature's digest is left out (so a log can't be replayed against the
+real app), as are the values of any params with 'secret' in their names.
+Replaying re-signs each request's payload with the local secret.
+"""
+import time
+import json
+import threading
+
+REDACTED = '[redacted]'
+SIGNATURE_KEY = 'hubspot.marketplace.signature'
+PREFIX = 'hubspot.marketplace.'
+
+
+class CaptureLog(object):
+    """
+    Appends one line per request to the file at path, safe to share between
+    threads
+    """
+
+    def __init__(self, path):
+        super(CaptureLog,self).__init__()
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'ab')
+
+    def entry(self, request, signature):
+        params = []
+        for k in request.REQUEST:
+            if k.startswith(PREFIX) and k != SIGNATURE_KEY:
+                val = request.REQUEST.get(k)
+                params.append([k, 'secret' in k.lower() and REDACTED or val])
+        try:
+            size = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            size = 0
+        return {
+            't': round(time.time(), 3),
+            'm': request.method,
+            'p': request.path,
+            'q': params,
+            's': (signature + '.').split('.')[1],
+            'b': size,
+        }
+
+    def write(self, request, signature):
+        line = json.dumps(self.entry(request, signature), separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read(path):
+    """
+    Yields the entries logged to the file at path, skipping any line that
+    didn't get written out whole
+    """
+    for line in open(path, 'rb'):
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
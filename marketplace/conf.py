@@ -0,0 +1,117 @@
+"""
+The marketplace settings, compiled once and shared by the middlewares and the
+decorators, so nobody has to dig through settings.py on the request path.
+
+    from marketplace import conf
+    if conf.get().authenticate:
+        ...
+
+The snapshot is rebuilt the next time it's asked for after any of the settings
+it's compiled from change (on django's setting_changed signal, where there is
+one), or after reset() is called.
+"""
+import copy
+import threading
+import django
+from django.conf import settings
+
+from marketplace import stats
+from marketplace.secret_index import SecretIndex
+
+# settings the snapshot is compiled from
+NAMES = (
+    'DEBUG',
+    'DEBUG_MODE_LOGGING',
+    'HUBSPOT_MARKETPLACE_AUTH',
+    'HUBSPOT_MARKETPLACE_LOGGING',
+    'HUBSPOT_MARKETPLACE_MOCK',
+    'HUBSPOT_MARKETPLACE_MOCK_SAFETY',
+    'HUBSPOT_MARKETPLACE_REWRITE',
+    'HUBSPOT_MARKETPLACE_REWRITE_CACHE',
+    'HUBSPOT_MARKETPLACE_STATS',
+    'HUBSPOT_MARKETPLACE_TEMPLATES',
+)
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+class MarketplaceSettings(object):
+    """
+    An immutable snapshot of the marketplace settings.  The setting dicts are
+    copies (with the auth keys lowercased, so 'SECRET_KEY' and 'secret_key'
+    mean the same thing), and the secrets are already indexed.
+    """
+
+    __slots__ = ('debug', 'debug_mode_logging', 'auth', 'mock', 'mock_safety',
+                 'secrets', 'authenticate', 'logging', 'rewrite',
+                 'rewrite_cache', 'stats', 'templates')
+
+    def __init__(self, source):
+        super(MarketplaceSettings,self).__init__()
+        auth = dict((k.lower(), v) for k, v in
+                    copy.deepcopy(getattr(source, 'HUBSPOT_MARKETPLACE_AUTH', {})).iteritems())
+        secrets = SecretIndex(auth)
+        values = {
+            'debug': getattr(source, 'DEBUG', False),
+            'debug_mode_logging': getattr(source, 'DEBUG_MODE_LOGGING', True),
+            'auth': auth,
+            'mock': copy.deepcopy(getattr(source, 'HUBSPOT_MARKETPLACE_MOCK', {})),
+            'mock_safety': getattr(source, 'HUBSPOT_MARKETPLACE_MOCK_SAFETY', None),
+            'secrets': secrets,
+            'authenticate': bool(secrets),
+            'logging': copy.deepcopy(getattr(source, 'HUBSPOT_MARKETPLACE_LOGGING', {})),
+            'rewrite': copy.deepcopy(getattr(source, 'HUBSPOT_MARKETPLACE_REWRITE', {})),
+            'rewrite_cache': copy.deepcopy(getattr(source, 'HUBSPOT_MARKETPLACE_REWRITE_CACHE', {})),
+            'stats': copy.deepcopy(getattr(source, 'HUBSPOT_MARKETPLACE_STATS', {})),
+            'templates': copy.deepcopy(getattr(source, 'HUBSPOT_MARKETPLACE_TEMPLATES', {})),
+        }
+        for k, v in values.iteritems():
+            object.__setattr__(self, k, v)
+
+    def __setattr__(self, attr, val):
+        raise AttributeError('marketplace settings are read only')
+
+    def __delattr__(self, attr):
+        raise AttributeError('marketplace settings are read only')
+
+
+def get():
+    """
+    Returns the current snapshot, compiling it if there isn't one
+    """
+    snapshot = _snapshot
+    if snapshot is None:
+        snapshot = _compile()
+    return snapshot
+
+
+def _compile():
+    global _snapshot
+    with _lock:
+        if _snapshot is None:
+            _snapshot = MarketplaceSettings(settings)
+        return _snapshot
+
+
+def reset(setting=None, **kwargs):
+    """
+    Throws the snapshot away (if setting is one it was compiled from, when
+    given), so the next get() compiles a fresh one, and sets the stats sink
+    up again from it
+    """
+    global _snapshot
+    if setting is None or setting in NAMES:
+        _snapshot = None
+        stats.reset()
+
+
+# django 1.3 doesn't have the signal (call reset() instead), 1.4 through 1.7
+# keep it with the test machinery, and later ones in core
+setting_changed = None
+if django.VERSION[:2] >= (1, 8):
+    from django.core.signals import setting_changed
+elif django.VERSION[:2] >= (1, 4):
+    from django.test.signals import setting_changed
+if setting_changed is not None:
+    setting_changed.connect(reset, dispatch_uid='marketplace.conf.reset')
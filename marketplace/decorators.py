@@ -1,5 +1,5 @@
-from django.conf import settings
 from django.http import HttpResponse
+import conf
 import logger
 
 """
@@ -25,17 +25,29 @@ development.
 """.strip()
 
 
-def marketplace(function=None):
+APP_ERROR = """
+This request was signed for the %s app, but this view was decorated so as to
+only take requests for the %s app!
+""".strip()
+
+
+def marketplace(function=None, slug=None):
     """
-    Use this decorator when you want to ensure marketplace authentication
+    Use this decorator when you want to ensure marketplace authentication.
+    Give it a slug to only let through requests that were signed with that
+    app's secrets (see the AuthMiddleware on serving several apps).
     """
 
     def _dec(view_func):
         def _view(request, *args, **kwargs):
-            authenticate = getattr(settings, 'HUBSPOT_MARKETPLACE_AUTH', {}).get('SECRET_KEY', False)
-            if authenticate and not getattr(request, 'marketplace', None):
+            if conf.get().authenticate and not getattr(request, 'marketplace', None):
                 logger.get_log('marketplace_decorator').error(AUTH_ERROR)
                 return HttpResponse(status=401)
+            elif conf.get().authenticate and slug is not None and \
+                    getattr(request.marketplace, 'app_slug', None) != slug:
+                logger.get_log('marketplace_decorator').error(APP_ERROR % (
+                        getattr(request.marketplace, 'app_slug', None) or 'default', slug))
+                return HttpResponse(status=401)
             else:
                 return view_func(request, *args, **kwargs)
         _view.__name__ = view_func.__name__
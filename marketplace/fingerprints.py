@@ -0,0 +1,103 @@
+"""
+Tells repeats of the same exception apart from new ones, cheaply enough to do
+for every exception a busy QA box throws.
+
+    tracker = FingerprintTracker(window=60, summary_interval=60, max_fingerprints=1000)
+    if tracker.seen(fingerprint(*sys.exc_info())):
+        log.error(..., exc_info=True)  # first time in the window
+    summary = tracker.summary()
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+def fingerprint(exc_type, exc_value, tb):
+    """
+    The exception's type, and the code location (file and line) of each frame
+    it was raised through.  Nothing gets formatted, so it's cheap to take.
+    """
+    locations = []
+    while tb is not None:
+        locations.append((tb.tb_frame.f_code.co_filename, tb.tb_lineno))
+        tb = tb.tb_next
+    return exc_type, tuple(locations)
+
+
+def describe(key):
+    """
+    A short label for a fingerprint: the type, and where it was raised from
+    """
+    exc_type, locations = key
+    if not locations:
+        return exc_type.__name__
+    filename, lineno = locations[-1]
+    return '%s at %s:%d' % (exc_type.__name__, os.path.basename(filename), lineno)
+
+
+class FingerprintTracker(object):
+    """
+Remembers the exceptions seen lately by fingerprint, so each one's traceback
+only has to be logged the first time it shows up in a window, and counts the
+repeats so they can be reported in summaries every so often instead.
+
+At most max_fingerprints are remembered, the least recently seen being
+forgotten first (its repeats still count toward the next summary's total).
+A window of 0 treats every exception as new.
+    """
+
+    def __init__(self, window=60, summary_interval=60, max_fingerprints=1000, clock=time.time):
+        super(FingerprintTracker,self).__init__()
+        self.window = window
+        self.summary_interval = summary_interval
+        self.max_fingerprints = max_fingerprints
+        self.clock = clock
+        self.entries = OrderedDict()  # fingerprint -> [first seen, repeats]
+        self.forgotten = 0  # repeats of fingerprints since forgotten
+        self.last_summary = clock()
+        self.lock = threading.Lock()
+
+    def seen(self, key):
+        """
+        Notes an exception.  True if its fingerprint is new in the window (so
+        it should be logged in full), False if it's a repeat.
+        """
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and now - entry[0] < self.window:
+                entry[1] += 1
+                self.entries[key] = entry
+                return False
+            repeats = entry is not None and entry[1] or 0
+            self.entries[key] = [now, repeats]
+            while len(self.entries) > self.max_fingerprints:
+                self.forgotten += self.entries.popitem(last=False)[1][1]
+            return True
+
+    def summary(self, force=False):
+        """
+        If summary_interval has passed since the last one (or if force), and
+        there were repeats since, returns (seconds, [(label, repeats)], other
+        repeats) with the most repeated first, and starts counting afresh.
+        Otherwise returns None.
+        """
+        now = self.clock()
+        if not force and now - self.last_summary < self.summary_interval:
+            return None
+        with self.lock:
+            if not force and now - self.last_summary < self.summary_interval:
+                return None  # another thread just took it
+            seconds = now - self.last_summary
+            self.last_summary = now
+            counts = []
+            for key, entry in self.entries.iteritems():
+                if entry[1]:
+                    counts.append((entry[1], key))
+                    entry[1] = 0
+            forgotten, self.forgotten = self.forgotten, 0
+        if not counts and not forgotten:
+            return None
+        counts.sort(key=lambda count: -count[0])
+        return seconds, [(describe(key), repeats) for repeats, key in counts], forgotten
@@ -0,0 +1,39 @@
+"""
+Attributes that aren't worked out until they're first used, so that importing
+a module (or setting up a middleware that ends up turned off) doesn't pay for
+compiling regexes.  (Templates are read on first use too, by
+marketplace.middleware.templates.)
+"""
+import re
+import threading
+
+
+class LazyAttribute(object):
+    """
+    A class attribute that's loaded the first time it's looked up (on the class
+    or on any instance) and kept from then on.  Setting the attribute on an
+    instance still overrides it for that instance.
+    """
+
+    def __init__(self, load):
+        super(LazyAttribute,self).__init__()
+        self.load = load
+        self.loaded = False
+        self.value = None
+        self.lock = threading.Lock()
+
+    def __get__(self, instance, owner):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.value = self.load()
+                    self.loaded = True
+        return self.value
+
+
+def lazy_re(pattern, flags=0):
+    """
+    A regex compiled on first use
+    """
+    return LazyAttribute(lambda: re.compile(pattern, flags))
+
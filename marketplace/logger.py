@@ -1,11 +1,217 @@
+"""
+Logging for the marketplace middlewares and decorators.
+
+get_log() hands out each logger set up just once.  By default that's a plain
+logging.Logger, but it can be told to log in the background (records are
+built on the calling thread and handed off through a bounded queue to a
+thread that renders any tracebacks and does the emitting, so request threads
+never wait on log I/O), and to let only a sample of a logger's records through:
+
+    HUBSPOT_MARKETPLACE_LOGGING = {
+        'background': True,
+        'queue_size': 10000,  # records waiting past this get dropped
+        'sample': {
+            'marketplace_decorator': 0.01,  # 1 in 100 of the 401s
+        },
+        'exceptions': {'window': 60},  # see DebugModeLoggingMiddleware
+    }
+"""
+import os
+import sys
+import time
+import atexit
 import logging
+import threading
+import Queue
+
+from marketplace import conf
+from marketplace import stats
+
+# where BackgroundLog calls come from doesn't count as where they came from
+_srcfile = os.path.normcase(os.path.splitext(__file__)[0] + '.py')
+
 
 class NullHandler(logging.Handler):
     def emit(self, record):
         pass
 
+
+class SampleFilter(logging.Filter):
+    """
+    Lets through the first of every so many records, marking each one it lets
+    through with how many it stands for (as record.sampled)
+    """
+
+    def __init__(self, rate):
+        logging.Filter.__init__(self)
+        self.every = rate > 0 and max(1, int(round(1.0 / rate))) or 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        with self.lock:
+            self.count += 1
+            keep = bool(self.every) and (self.count - 1) % self.every == 0
+        if keep:
+            record.sampled = self.every
+        return keep
+
+
+class QueueListener(object):
+    """
+    Hands queued records to their loggers' handlers from a background thread
+    """
+
+    def __init__(self, queue):
+        super(QueueListener,self).__init__()
+        self.queue = queue
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='marketplace-logging')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            logger, record = item
+            try:
+                logger.callHandlers(record)
+            except Exception:
+                pass  # a handler blowing up mustn't kill the listener
+
+    def stop(self, timeout=5.0):
+        """
+        Flushes whatever is queued up (for up to timeout seconds, all told,
+        even if a stuck handler has the queue full)
+        """
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            deadline = time.time() + timeout
+            try:
+                self.queue.put(None, timeout=timeout)
+            except Queue.Full:
+                return  # the thread's a daemon, so it won't hold up exiting
+            thread.join(max(0, deadline - time.time()))
+
+
+class BackgroundLog(object):
+    """
+    Stands in for a logger, building each record on the calling thread (so the
+    caller's exception and line number are the ones logged) and queueing it for
+    the listener.  If the queue is full the record is dropped rather than
+    making the caller wait.
+    """
+
+    def __init__(self, logger, queue, listener):
+        super(BackgroundLog,self).__init__()
+        self.logger = logger
+        self.queue = queue
+        self.listener = listener
+
+    def log(self, level, msg, *args, **kwargs):
+        logger = self.logger
+        if logger.disabled or not logger.isEnabledFor(level):
+            return
+        exc_info = kwargs.get('exc_info')
+        if exc_info and not isinstance(exc_info, tuple):
+            exc_info = sys.exc_info()
+        fn, lno, func = find_caller()
+        record = logger.makeRecord(logger.name, level, fn, lno, msg, args,
+                                   exc_info, func, kwargs.get('extra'))
+        if not logger.filter(record):
+            return
+        # the args could change before the listener gets to them (the
+        # traceback, if any, can wait for the listener to render it)
+        record.msg = record.getMessage()
+        record.args = None
+        self.listener.start()
+        try:
+            self.queue.put_nowait((logger, record))
+        except Queue.Full:
+            stats.incr('logging.dropped')
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log(logging.WARNING, msg, *args, **kwargs)
+
+    warn = warning
+
+    def error(self, msg, *args, **kwargs):
+        self.log(logging.ERROR, msg, *args, **kwargs)
+
+    def exception(self, msg, *args, **kwargs):
+        kwargs['exc_info'] = 1
+        self.log(logging.ERROR, msg, *args, **kwargs)
+
+    def critical(self, msg, *args, **kwargs):
+        self.log(logging.CRITICAL, msg, *args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.logger, attr)
+
+
+def find_caller():
+    """
+    The file, line and function that called into the BackgroundLog
+    """
+    frame = sys._getframe(1)
+    while frame is not None and os.path.normcase(frame.f_code.co_filename) in (_srcfile, logging._srcfile):
+        frame = frame.f_back
+    if frame is None:
+        return '(unknown file)', 0, '(unknown function)'
+    return frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name
+
+
+_lock = threading.Lock()
+_logs = {}  # name -> (settings snapshot, log)
+_queue = None
+_listener = None
+
+
 def get_log(name):
+    config = conf.get()
+    cached = _logs.get(name)
+    if cached is not None and cached[0] is config:
+        return cached[1]
+    with _lock:
+        log = setup_log(name, config.logging)
+        _logs[name] = (config, log)
+    return log
+
+
+def setup_log(name, options):
+    """
+    Sets the named logger up to match the options (only touching it where it
+    doesn't already match), and returns what to log to
+    """
+    global _queue, _listener
     logger = logging.getLogger(name)
-    logger.addHandler(NullHandler())
-    return logger
+    if not [h for h in logger.handlers if isinstance(h, NullHandler)]:
+        logger.addHandler(NullHandler())
+
+    for f in [f for f in logger.filters if isinstance(f, SampleFilter)]:
+        logger.removeFilter(f)
+    rate = options.get('sample', {}).get(name)
+    if rate is not None and rate < 1:
+        logger.addFilter(SampleFilter(rate))
 
+    if not options.get('background'):
+        return logger
+    if _queue is None:
+        _queue = Queue.Queue(options.get('queue_size', 10000))
+        _listener = QueueListener(_queue)
+        atexit.register(_listener.stop)
+    return BackgroundLog(logger, _queue, _listener)
@@ -0,0 +1,81 @@
+"""
+A small thread-safe LRU cache with expiring entries
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Holds on to at most max_size entries (and, if max_bytes is given, at most
+    that many bytes of values, as measured by sizeof), each for at most ttl
+    seconds (or forever if ttl is None), dropping the least recently used
+    entries when it's full.  Keeps count of its hits, misses and evictions.
+    """
+
+    def __init__(self, max_size, ttl=None, max_bytes=None, sizeof=len):
+        super(LRUCache,self).__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value, size = entry
+            if expires is not None and expires <= time.time():
+                self.bytes -= size
+                self.misses += 1
+                self.evictions += 1
+                return default
+            self.entries[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = self.ttl is not None and time.time() + self.ttl or None
+        size = self.max_bytes is not None and self.sizeof(value) or 0
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return  # would push everything else out and still not fit
+            self.entries[key] = (expires, value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_size or (
+                    self.max_bytes is not None and self.bytes > self.max_bytes):
+                self.bytes -= self.entries.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """
+        Returns the counters (and current size) as a dict
+        """
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -1,8 +1,13 @@
-import re
 #from marketplace import logger
+from marketplace import stats
+from marketplace.middleware.compat import MiddlewareMixin
+from marketplace.middleware.links import LinkRewriter
+from marketplace.middleware.streaming import is_streaming, get_chunks, set_chunks
+from marketplace.middleware.pipeline import pipeline_for
+from marketplace.middleware import policy
 
 
-class AnchorFixMiddleware(object):
+class AnchorFixMiddleware(MiddlewareMixin):
     """
 Use this middleware to make absolute paths in anchor tags be prepended with a
 protocol relative url.  This can be used as a fix for the current marketplace
@@ -13,18 +18,40 @@ http://docs.hubapi.com/wiki/Link_Rewriting
 
 This middleware essentially turns the box pointed to by <a> and by "Absolute
 Url" into something useful.
+
+Only pages get rewritten (see marketplace.middleware.policy for what counts).
+Regular responses are rewritten on the shared rewrite pipeline, in the same
+pass as the other rewriting middlewares.  Streamed (iterator-backed) responses
+are rewritten a chunk at a time as they go out, rather than being read into
+memory first.  Either way the rewriting is done by a LinkRewriter, in time
+linear in the page's length.
     """
 
-    def __init__(self):
-        super(AnchorFixMiddleware,self).__init__()
-        self.anchor_re = re.compile(r'(<a\s.*?)href="(/.*?)"')
+    # rewrites just what re.sub(r'(<a\s.*?)href="(/.*?)"', ...) would (see
+    # marketplace.middleware.links), without the regex's backtracking
+    anchor_links = LinkRewriter('<a', 'href')
+
+    def __init__(self, get_response=None):
+        super(AnchorFixMiddleware,self).__init__(get_response)
+        stats.configure()
 
+    @stats.timed('anchor_fix.process_response')
     def process_response(self, request, response):
         marketplace = request and getattr(request, 'marketplace', None)
-        if marketplace and getattr(marketplace,'base_url',None) and response.status_code==200:
-            content = response.content.decode('utf-8')
-            content = self.anchor_re.sub(r'\1href="%s\2"' % marketplace.base_url[0:-1], content)
-            response.content = content.encode('utf-8')
+        if marketplace and getattr(marketplace,'base_url',None) and response.status_code==200 \
+                and policy.rewritable(request, response):
+            base_url = marketplace.base_url[0:-1]
+            if isinstance(base_url, unicode):
+                base_url = base_url.encode('utf-8')
+            if is_streaming(response):
+                set_chunks(response, self.anchor_links.rewrite(
+                    get_chunks(response), base_url))
+            else:
+                rewrite_range = lambda content, start, end: \
+                        self.anchor_links.sub_range(content, start, end, base_url)
+                pipeline_for(response).add(
+                        lambda document: document.rewrite(rewrite_range),
+                        ('anchor_fix', base_url))
         return response
 
 
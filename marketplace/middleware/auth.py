@@ -1,13 +1,18 @@
-from django.conf import settings
 from django.core.exceptions import MiddlewareNotUsed
-import hashlib
-import hmac
-import base64
+import copy
+import time
+from marketplace import conf
 from marketplace import logger
+from marketplace import stats
+from marketplace.middleware.compat import MiddlewareMixin
 from marketplace import RequestSupplement
+from marketplace.lru_cache import LRUCache
+from marketplace.capture import CaptureLog
+from marketplace.session_token import SessionTokens
+from marketplace.secret_index import base64_url_decode_for_real
 
 
-class AuthMiddleware(object):
+class AuthMiddleware(MiddlewareMixin):
     """
 Use this middleware to ensure requests are coming from HubSpot and that they
 are intended for your app.  To use, you'll need to:
@@ -27,39 +32,200 @@ authentication is established at this layer, it isn't enforced unless you've
 applied the @marketplace decorator on your view function.  And the code doesn't
 enforce it until it executes that decorator (which happens after all the
 middlewares have executed).
+
+A canvas page tends to fire off a burst of requests that all carry the same
+signature, so signatures that check out are remembered for a little while
+(just that they checked out -- each request still gets its own lazy
+RequestSupplement, so nothing about its params is looked at unless a view
+asks).  Only good signatures are cached, so junk signatures can't push good
+ones out.  The cache can be
+tuned or turned off (with a size of 0) in the same settings:
+
+    HUBSPOT_MARKETPLACE_AUTH = {
+        'secret_key': 'hubspot-issued-secret-key-here',
+        'signature_cache_size': 1024,  # signatures
+        'signature_cache_ttl': 300,  # seconds
+    }
+
+Several apps can share one django project, each with its own secret, and
+secrets can be rotated without turning anybody away by listing the old ones
+as previous_secret_keys until the new one has gone out everywhere.  Each app
+is given the path its views are served from, and each request is checked
+against the secrets of the app whose path it's on, or the top level ones if
+it's on none of them (see marketplace.secret_index for the details):
+
+    HUBSPOT_MARKETPLACE_AUTH = {
+        'secret_key': 'hubspot-issued-secret-key-here',
+        'previous_secret_keys': ['the-one-before-that'],
+        'apps': {
+            'yourotherslug': {
+                'secret_key': 'yourotherslug-secret-key',
+                'previous_secret_keys': [],
+                'path': '/other/',
+            },
+        },
+    }
+
+The slug of the app whose secrets checked out goes on the request as
+request.marketplace.app_slug (None for the top level ones), so a view can
+make sure it's looking at a request for its own app -- the @marketplace
+decorator does that with @marketplace(slug='yourotherslug').
+
+To profile real traffic offline, turn on capture mode.  Every authenticated
+request then gets appended to a log file (see marketplace.capture for what's
+kept and what's redacted), which bench/replay.py can run back through your
+middlewares and views:
+
+    HUBSPOT_MARKETPLACE_AUTH = {
+        'secret_key': 'hubspot-issued-secret-key-here',
+        'capture': '/var/log/yourapp/marketplace-capture.log',
+    }
+
+Only the requests the marketplace signs get a request.marketplace.  To give
+the requests a canvas page makes after it loads (AJAX calls and such) their
+marketplace context too, turn on session tokens:
+
+    HUBSPOT_MARKETPLACE_AUTH = {
+        'secret_key': 'hubspot-issued-secret-key-here',
+        'session_ttl': 3600,  # seconds a token is good for
+    }
+
+Every signed request then also gets a request.marketplace_token (see
+marketplace.session_token), which the page can send back on its follow-up
+requests, either as an X-HubSpot-Marketplace-Token header or as a
+hubspot.marketplace.token param, to get request.marketplace restored without
+any further verification against the marketplace.  Tokens aren't encrypted,
+so the signature and any secret params are left out of them.
     """
 
     DEACTIVATION_NOTICE = """
 HubSpot marketplace request authentication has been deactivated for all
-requests!  (because there was no secret key specified in settings.py.  Gotta
+requests!  (because there were no secret keys specified in settings.py.  Gotta
 specify there if you wanna turn on authentication!)
 """.strip()
 
     SIGNATURE_KEY = 'hubspot.marketplace.signature'
-            
-    def __init__(self):
-        super(AuthMiddleware, self).__init__()
+    TOKEN_KEY = 'hubspot.marketplace.token'
+    TOKEN_HEADER = 'HTTP_X_HUBSPOT_MARKETPLACE_TOKEN'
+    SIGNATURE_CACHE_SIZE = 1024
+    SIGNATURE_CACHE_TTL = 300
+
+    def __init__(self, get_response=None):
+        super(AuthMiddleware, self).__init__(get_response)
+        stats.configure()
         self.log = logger.get_log(__name__)
-        auth = getattr(settings, 'HUBSPOT_MARKETPLACE_AUTH', {})
-        self.secret = auth.get('secret_key')
-        if not self.secret:
+        config = conf.get()
+        auth = config.auth
+        self.secrets = config.secrets
+        if not self.secrets:
             self.log.warn(self.__class__.DEACTIVATION_NOTICE)
             raise MiddlewareNotUsed
+        for slug in self.secrets.unrouted:
+            self.log.warn('no path given for the %s app, so no requests will be checked against its secrets' % slug)
+        cache_size = auth.get('signature_cache_size', self.__class__.SIGNATURE_CACHE_SIZE)
+        cache_ttl = auth.get('signature_cache_ttl', self.__class__.SIGNATURE_CACHE_TTL)
+        self.signatures = None
+        if cache_size:
+            self.signatures = LRUCache(cache_size, cache_ttl)
+        self.tokens = None
+        self.sessions = None
+        if auth.get('session_ttl'):
+            self.tokens = SessionTokens(self.secrets, auth['session_ttl'])
+            if cache_size:
+                self.sessions = LRUCache(cache_size, cache_ttl)
+        self.capture = None
+        if auth.get('capture'):
+            self.capture = CaptureLog(auth['capture'])
+            self.log.info('capturing marketplace requests to %s' % auth['capture'])
 
+    @stats.timed('auth.process_request')
     def process_request(self, request):
         """adds MarketPlaceInfo object to request at request.marketplace"""
         signature = request.REQUEST.get(self.__class__.SIGNATURE_KEY, '').strip()
-        if self.is_request_authentic(signature):
+        if not signature:
+            if self.tokens is None or not self.restore_session(request):
+                stats.incr('auth.missing')
+            return
+        signature = str(signature)  # convert from unicode
+        slug = self.secrets.slug_for(request)
+        cached = self.signatures is not None and self.signatures.get((slug, signature))
+        if cached or self.verify_signature(signature, slug):
+            stats.incr(cached and 'auth.pass.cached' or 'auth.pass')
             request.marketplace = RequestSupplement(request)
+            request.marketplace.app_slug = slug
+            if self.tokens is not None:
+                request.marketplace_token = self.issue_token(request, slug)
+            if self.capture is not None:
+                try:
+                    self.capture.write(request, signature)
+                except IOError:
+                    self.log.exception('could not capture marketplace request')
+        else:
+            stats.incr('auth.fail')
+
+    def issue_token(self, request, slug=None):
+        """
+        A session token for the marketplace params on this request
+        """
+        stats.incr('auth.token.issued')
+        signature_key = self.__class__.SIGNATURE_KEY
+        params = [(k, v) for k, v in RequestSupplement.marketplace_params(request)
+                  if k != signature_key and 'secret' not in k.lower()]
+        return self.tokens.issue(params, slug)
 
-    def is_request_authentic(self, signature):
+    def restore_session(self, request):
+        """
+        Restores request.marketplace from the request's session token, if it
+        has one that's good, returning whether it did
+        """
+        token = request.META.get(self.__class__.TOKEN_HEADER) or \
+                request.REQUEST.get(self.__class__.TOKEN_KEY)
+        if not token:
+            return False
+        try:
+            token = str(token.strip())
+        except UnicodeError:
+            stats.incr('auth.token.fail')  # can't be one of ours
+            return False
+        slug = self.secrets.slug_for(request)
+        cached = self.sessions is not None and self.sessions.get((slug, token))
+        if cached and cached[0] > time.time():
+            stats.incr('auth.token.pass.cached')
+            request.marketplace = copy.copy(cached[1])
+            return True
+        restored = self.tokens.restore(token, slug)
+        if restored is None:
+            stats.incr('auth.token.fail')
+            return False
+        params, expires = restored
+        stats.incr('auth.token.pass')
+        supplement = RequestSupplement(None, params)
+        supplement.app_slug = slug
+        if self.sessions is not None:
+            self.sessions.set((slug, token), (expires, copy.copy(supplement)))
+        request.marketplace = supplement
+        return True
+
+    def is_request_authentic(self, signature, slug=None):
         """ensures this request was issued by HubSpot"""
         signature = str(signature)  # convert from unicode
-        digest, payload = [
-                self.base64_url_decode_for_real(s) 
-                    for s in (signature+'.').split('.')[0:2]]
-        return (digest and payload and 
-                digest == hmac.new(self.secret, payload, hashlib.sha1).digest())
+        if self.signatures is not None and self.signatures.get((slug, signature)):
+            return True
+        return self.verify_signature(signature, slug)
+
+    @stats.timed('auth.verify')
+    def verify_signature(self, signature, slug=None):
+        """
+        checks the signature's digest against its payload with the app's
+        secrets, skipping the cache (but remembering the signature if it's good)
+        """
+        key = self.secrets.verify(signature, slug)
+        if key:
+            stats.incr('auth.pass.previous_key')
+        authentic = key is not None
+        if authentic and self.signatures is not None:
+            self.signatures.set((slug, signature), True)
+        return authentic
 
 
     def base64_url_decode_for_real(self, encoded_s):
@@ -69,6 +235,6 @@ specify there if you wanna turn on authentication!)
         method is urlsafe for real, and matches what the marketplace is
         expecting 
         """
-        return base64.urlsafe_b64decode(encoded_s + '=' * (4 - len(encoded_s) % 4))
+        return base64_url_decode_for_real(encoded_s)
 
 
@@ -0,0 +1,90 @@
+"""
+Output for the rewriting middlewares that's built up a bit at a time without
+ever being glued back together into one big string.
+"""
+
+
+class ChunkWriter(object):
+    """
+Collects a rewritten page's output as a list of chunks of about CHUNK_SIZE
+bytes.  Little bits get joined into a chunk as they fill one up, and big
+stretches of the original are kept as chunks of their own, so the page is
+copied about once, rather than once as bits and again to join them, and the
+server isn't handed thousands of tiny strings to write out.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self):
+        super(ChunkWriter,self).__init__()
+        self.chunks = []
+        self.pending = []
+        self.size = 0  # bytes pending
+
+    def write(self, s):
+        if len(s) >= self.CHUNK_SIZE:
+            self.flush()
+            self.chunks.append(s)
+            return
+        self.pending.append(s)
+        self.size += len(s)
+        if self.size >= self.CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.chunks.append(''.join(self.pending))
+            self.pending = []
+            self.size = 0
+
+    def getvalue(self):
+        """
+        The chunks written so far
+        """
+        self.flush()
+        return self.chunks
+
+
+def splice(content, start, end, points, text):
+    """
+    content[start:end] with text put in at each of the (ascending) points,
+    as a list of chunks
+    """
+    chunk_size = ChunkWriter.CHUNK_SIZE
+    chunks = []
+    parts = []
+    append = parts.append
+    pos = mark = start
+    for at in points:
+        if at - pos >= chunk_size:
+            if parts:
+                chunks.append(''.join(parts))
+                parts = []
+                append = parts.append
+            chunks.append(content[pos:at])
+            mark = at
+        else:
+            append(content[pos:at])
+        append(text)
+        pos = at
+        if pos - mark >= chunk_size:
+            chunks.append(''.join(parts))
+            parts = []
+            append = parts.append
+            mark = pos
+    return finish(chunks, parts, content, pos, end)
+
+
+def finish(chunks, parts, content, pos, end):
+    """
+    Adds what's left (the parts not yet joined and content[pos:end]) to the
+    chunks
+    """
+    if end - pos >= ChunkWriter.CHUNK_SIZE:
+        if parts:
+            chunks.append(''.join(parts))
+        chunks.append(content[pos:end])
+    else:
+        parts.append(content[pos:end])
+        chunks.append(''.join(parts))
+    return chunks
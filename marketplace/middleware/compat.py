@@ -0,0 +1,29 @@
+"""
+Lets the marketplace middlewares run under either style of middleware setting.
+"""
+
+
+class MiddlewareMixin(object):
+    """
+Base for the marketplace middlewares, so that each one works both as an
+old-style middleware (in MIDDLEWARE_CLASSES, where django calls its process_*
+hooks itself) and as a new-style one (in MIDDLEWARE, where django hands it the
+next get_response and calls it once per request).  Called new-style, it runs
+its own process_request and process_response around get_response, just as the
+old-style handler would have.  Any process_view and process_exception hooks
+are picked up by django directly either way.
+    """
+
+    def __init__(self, get_response=None):
+        super(MiddlewareMixin,self).__init__()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = None
+        if hasattr(self, 'process_request'):
+            response = self.process_request(request)
+        if response is None:
+            response = self.get_response(request)
+        if hasattr(self, 'process_response'):
+            response = self.process_response(request, response)
+        return response
@@ -1,10 +1,20 @@
-import traceback
-from django.conf import settings
+import sys
+import atexit
+import threading
 from django.core.exceptions import MiddlewareNotUsed
+from marketplace import conf
 from marketplace import logger
+from marketplace import stats
+from marketplace.fingerprints import fingerprint, FingerprintTracker
+from marketplace.middleware.compat import MiddlewareMixin
 
+SUMMARY_TOP = 10  # exceptions named in a summary, the rest just counted
 
-class DebugModeLoggingMiddleware(object):
+_tracker = (None, None)  # (its settings, the tracker every instance shares)
+_lock = threading.Lock()
+
+
+class DebugModeLoggingMiddleware(MiddlewareMixin):
     """
 Use this middleware to force logging of errors even when Debug = True.  You'll
 find this useful in the case that you have QA in DEBUG mode, and you'd still
@@ -19,20 +29,96 @@ DEBUG_MODE_LOGGING = False
 You might find it useful to do that for local development, since it may get
 annoying to wade through exception logs on your console when you're already
 seeing every error on the screen.
+
+When the same bug gets hit over and over (a QA box under load, say), only the
+first time in a while gets logged with its traceback.  Exceptions are told
+apart by their type and the file and line of every frame they came through,
+and the repeats are counted and logged as a summary every so often instead,
+with the first response or exception after the summary interval is up (and
+when the process exits).  How long "a while" is, how often the summaries go
+out and how many different exceptions get remembered can be set in your
+settings.py (a window of 0 logs every exception in full):
+
+    HUBSPOT_MARKETPLACE_LOGGING = {
+        'exceptions': {
+            'window': 60,  # seconds
+            'summary_interval': 60,  # seconds
+            'max_fingerprints': 1000,
+        },
+    }
     """
 
-    def __init__(self):
-        super(DebugModeLoggingMiddleware,self).__init__()
+    def __init__(self, get_response=None):
+        super(DebugModeLoggingMiddleware,self).__init__(get_response)
+        stats.configure()
         self.log = logger.get_log(__name__)
-        if not getattr(settings, 'DEBUG', False):
+        config = conf.get()
+        if not config.debug:
             self.log.info('DebugModeLoggingMiddleware has been turned off for all requests cuz we\'re not in debug mode')
             raise MiddlewareNotUsed
-        if not getattr(settings, 'DEBUG_MODE_LOGGING', True):
+        if not config.debug_mode_logging:
             self.log.info('DebugModeLoggingMiddleware has been explicitly turned off for all requests')
             raise MiddlewareNotUsed
+        self.tracker = shared_tracker(config.logging.get('exceptions', {}))
         self.log.info('DebugModeLoggingMiddleware has been activated')
 
+    @stats.timed('debug_mode_logging.process_exception')
     def process_exception(self, request, exception):
-        if settings.DEBUG:
-            self.log.error(traceback.format_exc(exception))
+        if conf.get().debug:
+            stats.incr('debug_mode_logging.exceptions')
+            exc_info = sys.exc_info()
+            if exc_info[1] is not exception:
+                exc_info = (exception.__class__, exception, None)
+            if self.tracker.seen(fingerprint(*exc_info)):
+                # the traceback gets rendered by the handler, which may be on
+                # the logging thread rather than this one
+                self.log.error('%s %s raised %s', request.method, request.path,
+                               exception.__class__.__name__, exc_info=exc_info)
+            else:
+                stats.incr('debug_mode_logging.repeats')
+            report_repeats()
+
+    @stats.timed('debug_mode_logging.process_response')
+    def process_response(self, request, response):
+        report_repeats()  # in case the exceptions have stopped
+        return response
+
+
+def shared_tracker(options):
+    """
+    The FingerprintTracker every DebugModeLoggingMiddleware shares, set up
+    from the 'exceptions' logging options, so a handler reload or another
+    middleware chain carries on with the same counts
+    """
+    global _tracker
+    settings = (options.get('window', 60), options.get('summary_interval', 60),
+                options.get('max_fingerprints', 1000))
+    with _lock:
+        if _tracker[0] != settings:
+            report_repeats(True)  # whatever the one being replaced counted
+            _tracker = (settings, FingerprintTracker(*settings))
+        return _tracker[1]
+
+
+def report_repeats(force=False):
+    """
+    Logs how many times each exception was repeated since the last summary,
+    if it's time for one (or if force)
+    """
+    tracker = _tracker[1]
+    summary = tracker is not None and tracker.summary(force)
+    if not summary:
+        return
+    seconds, counts, forgotten = summary
+    total = sum(repeats for label, repeats in counts) + forgotten
+    named = ['%s (x%d)' % count for count in counts[:SUMMARY_TOP]]
+    others = total - sum(repeats for label, repeats in counts[:SUMMARY_TOP])
+    if others:
+        named.append('%d other(s)' % others)
+    logger.get_log(__name__).warning(
+            '%d repeated exception(s) not logged again in the last %ds: %s',
+            total, seconds, ', '.join(named))
+
+
+atexit.register(report_repeats, True)
 
@@ -1,11 +1,19 @@
 import re
-import os
-from django.conf import settings
+import itertools
 from django.core.exceptions import MiddlewareNotUsed
+from marketplace import conf
 from marketplace import logger
+from marketplace import stats
+from marketplace.lazy import lazy_re
+from marketplace.middleware.compat import MiddlewareMixin
+from marketplace.middleware.streaming import (
+        is_streaming, get_chunks, set_chunks, read_through, insert_before)
+from marketplace.middleware.pipeline import pipeline_for
+from marketplace.middleware import policy
+from marketplace.middleware import templates
 
 
-class ErrorGogglesMiddleware(object):
+class ErrorGogglesMiddleware(MiddlewareMixin):
     """
 Use this middleware to make django error stack traces show up properly inside
 the marketplace wrapper.  If you've ever had to deal with a stack trace
@@ -14,36 +22,106 @@ issue is.
 
 This middleware will only attempt to reformat for the marketplace when the
 django app is in DEBUG mode.  Otherwise it won't attempt anything
+
+Streamed (iterator-backed) responses are only read as far as their <body> tag;
+the rest of the page streams through as it comes.
+
+The body gets wrapped in error_goggles.html, with the reset styles from
+error_goggles_reset.css filled in, and either can be skinned (see
+marketplace.middleware.templates).
     """
 
+    head_re = lazy_re(r'<head>(.*?)</head>', re.DOTALL)
+    body_re = lazy_re(r'<body>(.*?)</body>', re.DOTALL)
+    style_re = lazy_re(r'<style type="text/css">(.*?)</style>', re.DOTALL)
+    script_re = lazy_re(r'<script type="text/javascript">(.*?)</script>', re.DOTALL)
+
+    WRAPPER = 'error_goggles.html'
+    RESET_STYLES = 'error_goggles_reset.css'
+    PLACEHOLDERS = ('HEAD_SCRIPTS', 'RESET_STYLES', 'HEAD_STYLES', 'BODY_CONTENTS')
+    REQUIRED_PLACEHOLDERS = ('BODY_CONTENTS',)  # where a streamed page goes
+    filled = (None, None, None)  # (wrapper, reset styles, wrapper with them in)
 
-    def __init__(self):
-        super(ErrorGogglesMiddleware,self).__init__()
+    def __init__(self, get_response=None):
+        super(ErrorGogglesMiddleware,self).__init__(get_response)
+        stats.configure()
         self.log = logger.get_log(__name__)
-        debug_mode = getattr(settings, 'DEBUG', False)
+        debug_mode = conf.get().debug
         if not debug_mode:
             self.log.info('ErrorGogglesMiddleware has been turned off for all requests because we are not in DEBUG mode')
             raise MiddlewareNotUsed
-        self.head_re = re.compile(r'<head>(.*?)</head>',re.DOTALL)
-        self.body_re = re.compile(r'<body>(.*?)</body>',re.DOTALL)
-        self.style_re = re.compile(r'<style type="text/css">(.*?)</style>', re.DOTALL)
-        self.script_re = re.compile(r'<script type="text/javascript">(.*?)</script>', re.DOTALL)
-        self.reset_styles = open(os.path.join(os.path.dirname(__file__),'error_goggles_reset.css')).read()
         self.log.info('ErrorGogglesMiddleware has been activated')
 
+    @stats.timed('error_goggles.process_response')
     def process_response(self, request, response):
         marketplace = request and getattr(request, 'marketplace', None)
-        if marketplace and response.status_code >= 400:
-            if self.head_re.search(response.content) and self.body_re.search(response.content):
-                head = self.head_re.findall(response.content)[0]
-                body = self.body_re.findall(response.content)[0]
-                body = '<div class="hsmpdjerr">%s</div>' % body
-                for style in self.style_re.findall(head):
-                    body = '<style type="text/css">%s</style>'%style + body
-                body = '<style type="text/css">%s</style>'%self.reset_styles + body
-                for script in self.script_re.findall(head):
-                    body = '<script type="text/javascript">%s</script>' % script + body
-                response.content = self.body_re.sub('<body>%s</body>'%body, response.content)
+        if marketplace and response.status_code >= 400 and policy.rewritable(request, response):
+            wrapper = self.wrapper()
+            if is_streaming(response):
+                set_chunks(response, self.stream_response(get_chunks(response), wrapper))
+            else:
+                pipeline_for(response).add(
+                        lambda document: self.rewrite_document(document, wrapper),
+                        ('error_goggles', wrapper.version))
         return response
 
+    def wrapper(self):
+        """
+        The compiled wrapper, with the reset styles already in it
+        """
+        wrapper = templates.get(self.WRAPPER, self.PLACEHOLDERS, self.REQUIRED_PLACEHOLDERS)
+        reset = templates.get(self.RESET_STYLES, ())
+        filled = self.filled
+        if filled[0] is not wrapper or filled[1] is not reset:
+            filled = self.filled = (wrapper, reset, wrapper.fill(
+                    {'RESET_STYLES': ''.join(reset.render({}))}))
+        return filled[2]
+
+    def rewrite_document(self, document, wrapper=None):
+        """
+        Moves the head's styles and scripts into the body, and boxes the body
+        up so the reset styles can get at it
+        """
+        if not document.find_body():
+            return
+        head = document.search_before(self.head_re)
+        if not head:
+            head = self.head_re.search(document.text())
+            if not head:
+                return
+        values = self.head_values(head.group(1))
+        values['BODY_CONTENTS'] = document.body()
+        document.replace_body((wrapper or self.wrapper()).render(values))
+
+    def head_values(self, head):
+        """
+        The head's scripts and styles, each joined up to go in the wrapper
+        """
+        return {
+            'HEAD_SCRIPTS': ''.join(['<script type="text/javascript">%s</script>' % script
+                                     for script in reversed(self.script_re.findall(head))]),
+            'HEAD_STYLES': ''.join(['<style type="text/css">%s</style>' % style
+                                    for style in reversed(self.style_re.findall(head))]),
+        }
 
+    def stream_response(self, chunks, wrapper=None):
+        """
+        Yields the page with the error body dressed up, having only read ahead
+        as far as <body>
+        """
+        content = read_through(chunks, '<body>')
+        head = self.head_re.search(content)
+        at = content.find('<body>')
+        if not head or at == -1 or at < head.end():
+            for chunk in itertools.chain([content], chunks):
+                yield chunk
+            return
+        at += len('<body>')
+        before, after = (wrapper or self.wrapper()).around(
+                'BODY_CONTENTS', self.head_values(head.group(1)))
+        yield content[:at]
+        for piece in before:
+            yield piece
+        rest = itertools.chain([content[at:]], chunks)
+        for chunk in insert_before(rest, '</body>', ''.join(after)):
+            yield chunk
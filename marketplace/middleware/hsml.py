@@ -0,0 +1,278 @@
+from marketplace.lazy import lazy_re
+from marketplace.middleware.chunks import ChunkWriter
+from marketplace.middleware.scan import NextFinder
+
+
+class HsmlRewriter(object):
+    """
+Rewrites the hsml in a canvas page the way the marketplace does in production,
+walking the page body exactly once.
+
+The body is split into the pieces the mock wrapper needs: the head contents
+(every <hs:link> turned into a <link>, followed by every <hs:head> block), the
+body itself (with all hs tags stripped and absolute form actions pointed back
+at the canvas) and the bottom contents (every <hs:script> turned into a
+<script>).
+
+Each hs tag is matched exactly as the old per-tag regexes matched it, so the
+output is identical to running those regexes one after another, as long as hs
+tags aren't tucked inside the attributes of another hs tag or of a <form> tag.
+Unlike those regexes, though, nothing gets searched more than a bounded number
+of times, so a page full of unclosed hs tags still takes linear time.
+    """
+
+    BODY_START = '<body>'
+    BODY_END = '</body>'
+
+    LINK_START = '<hs:link '
+    HEAD_START = '<hs:head>'
+    HEAD_END = '</hs:head>'
+    TITLE_START = '<hs:title'
+    TITLE_END = '</hs:title>'
+    SCRIPT_START = '<hs:script'
+    SCRIPT_END = '</hs:script>'
+
+    token_re = lazy_re(r'<hs:(?:link |head>|title|script)')
+
+    def rewrite(self, content, form_prefix):
+        """
+        Returns a (head, body, bottom) tuple for the first <body> in content,
+        or None if there isn't one.  The body comes back as a list of chunks.
+        Absolute form actions get form_prefix stuck in front of them.
+        """
+        start = content.find(self.BODY_START)
+        if start == -1:
+            return None
+        start += len(self.BODY_START)
+        end = content.find(self.BODY_END, start)
+        if end == -1:
+            return None
+        return self.rewrite_body(content, start, end, form_prefix)
+
+    def rewrite_body(self, content, start, end, form_prefix):
+        """
+        Returns the (head, body, bottom) tuple for the body that runs from
+        start to end in content, reading it in place
+        """
+        links = []
+        heads = []
+        scripts = []
+        body = ChunkWriter()
+        forms = FormActions(content, form_prefix, body)
+        finder = NextFinder(content, end)
+        pos = search = start  # everything from pos on is still to be kept
+        while True:
+            match = self.token_re.search(content, search, end)
+            if not match:
+                break
+            at = match.start()
+            stop = self._hs_tag(content, at, finder, links, heads, scripts)
+            if stop is None:
+                search = at + 1  # not a tag after all, so it stays
+            else:
+                forms.keep(pos, at)
+                pos = search = stop
+        forms.keep(pos, end)
+        forms.close()
+
+        head = ''.join(["\n<link %s />" % l for l in links] +
+                       ["\n%s" % h for h in heads])
+        bottom = ''.join(["\n<script%s>%s</script>" % s for s in scripts])
+        return head, body.getvalue(), bottom
+
+    def _hs_tag(self, content, at, finder, links, heads, scripts):
+        """
+        Consumes the hs tag starting at `at`, collecting whatever it carries.
+        Returns where the tag ends, or None if it isn't a complete tag.
+        """
+        if content.startswith(self.LINK_START, at):
+            inner = at + len(self.LINK_START)
+            close = self._in_line(finder, finder.find('>', inner), inner)
+            if close == -1:
+                return None
+            link = content[inner:close]
+            links.append(link[:-1] if link.endswith('/') else link)
+            return close + 1
+
+        if content.startswith(self.HEAD_START, at):
+            inner = at + len(self.HEAD_START)
+            close = finder.find(self.HEAD_END, inner)
+            if close == -1:
+                return None
+            stop = close + len(self.HEAD_END)
+            self._nested(content, inner, stop, links, None, scripts)
+            heads.append(content[inner:close])
+            return stop
+
+        if content.startswith(self.TITLE_START, at):
+            attrs = at + len(self.TITLE_START)
+            gt = self._in_line(finder, finder.find('>', attrs), attrs)
+            if gt == -1:
+                return None
+            close = self._in_line(finder, finder.find(self.TITLE_END, gt + 1), attrs)
+            if close == -1:
+                return None
+            stop = close + len(self.TITLE_END)
+            self._nested(content, attrs, stop, links, heads, scripts)
+            return stop
+
+        attrs = at + len(self.SCRIPT_START)
+        gt = finder.find('>', attrs)
+        if gt == -1:
+            return None
+        close = finder.find(self.SCRIPT_END, gt + 1)
+        if close == -1:
+            return None
+        stop = close + len(self.SCRIPT_END)
+        self._nested(content, attrs, stop, links, heads, None)
+        scripts.append((content[attrs:gt], content[gt+1:close]))
+        return stop
+
+    def _nested(self, content, start, end, links, heads, scripts):
+        """
+        Collects hs tags hiding inside a tag that's being stripped, since
+        those still make it into the head and bottom contents.  Matches what
+        re.findall(r'<hs:link (.*?)/?>'), re.findall(r'<hs:head>(.*?)</hs:head>',
+        re.DOTALL) and re.findall(r'<hs:script(.*?)>(.*?)</hs:script>',
+        re.DOTALL) would find between start and end.
+        """
+        if content.find('<hs:', start, end) == -1:
+            return
+        finder = NextFinder(content, end)
+
+        pos = finder.find(self.LINK_START, start)
+        while pos != -1:
+            inner = pos + len(self.LINK_START)
+            close = self._in_line(finder, finder.find('>', inner), inner)
+            if close == -1:
+                pos = finder.find(self.LINK_START, pos + 1)
+                continue
+            link = content[inner:close]
+            links.append(link[:-1] if link.endswith('/') else link)
+            pos = finder.find(self.LINK_START, close + 1)
+
+        # unlike a link, once a head or script goes unclosed so does every
+        # one after it, so these stop at the first that does
+        if heads is not None:
+            pos = finder.find(self.HEAD_START, start)
+            while pos != -1:
+                inner = pos + len(self.HEAD_START)
+                close = finder.find(self.HEAD_END, inner)
+                if close == -1:
+                    break
+                heads.append(content[inner:close])
+                pos = finder.find(self.HEAD_START, close + len(self.HEAD_END))
+
+        if scripts is not None:
+            pos = finder.find(self.SCRIPT_START, start)
+            while pos != -1:
+                attrs = pos + len(self.SCRIPT_START)
+                gt = finder.find('>', attrs)
+                if gt == -1:
+                    break
+                close = finder.find(self.SCRIPT_END, gt + 1)
+                if close == -1:
+                    break
+                scripts.append((content[attrs:gt], content[gt+1:close]))
+                pos = finder.find(self.SCRIPT_START, close + len(self.SCRIPT_END))
+
+    def _in_line(self, finder, found, since):
+        """
+        Turns a find() result into -1 if a newline sits between since and it
+        """
+        if found == -1 or not finder.in_line(since, found):
+            return -1
+        return found
+
+
+class FormActions(object):
+    """
+    Points absolute form actions back at the canvas as the kept pieces of a
+    body go by.  The hs tags have already been cut out from between those
+    pieces, so a <form> tag and its action still line up even when stripped
+    hs tags sat between them.  Output is held back from the ChunkWriter only
+    while a prefixed action is waiting on its closing quote.
+    """
+
+    FORM_RE = lazy_re(r'<form\s')
+    ACTION = 'action="'
+
+    def __init__(self, content, form_prefix, out):
+        super(FormActions,self).__init__()
+        self.content = content
+        self.form_prefix = form_prefix
+        self.out = out
+        self.armed = False  # saw a <form on this line, still hunting its action
+        self.held = None  # what's come since a prefix that's waiting on its quote
+
+    def keep(self, start, end):
+        """
+        Appends content[start:end] to the output, rewriting actions as it goes
+        """
+        content = self.content
+        emitted = pos = start
+        newline = content.find('\n', pos, end)
+        while pos < end:
+            if newline != -1 and newline < pos:
+                newline = content.find('\n', pos, end)
+            line_end = end if newline == -1 else newline
+
+            if self.held is not None:
+                quote = content.find('"', pos, line_end)
+                if quote != -1:
+                    self.release(True)
+                    pos = quote + 1
+                    continue
+                if newline == -1:
+                    break
+                self.release(False)  # no closing quote on this line
+                pos = max(pos, newline - len('<form'))
+                continue
+
+            if self.armed:
+                action = content.find(self.ACTION + '/', pos, line_end)
+                if action != -1:
+                    value = action + len(self.ACTION)
+                    self.emit(content, emitted, value)
+                    self.held = []
+                    self.armed = False
+                    emitted = value
+                    pos = value + 1
+                    continue
+                if newline == -1:
+                    break
+                self.armed = False
+                pos = max(pos, newline - len('<form'))  # '<form\n' arms the next line
+                continue
+
+            form = self.FORM_RE.search(content, pos, end)
+            if not form:
+                break
+            self.armed = True
+            pos = form.end()
+
+        self.emit(content, emitted, end)
+
+    def emit(self, content, start, end):
+        if start < end:
+            if self.held is None:
+                self.out.write(content[start:end])
+            else:
+                self.held.append(content[start:end])
+
+    def release(self, prefixed):
+        """
+        Writes out what was held back, after the prefix if it's staying
+        """
+        held, self.held = self.held, None
+        if prefixed:
+            self.out.write(self.form_prefix)
+        for piece in held:
+            self.out.write(piece)
+
+    def close(self):
+        """
+        Drops a prefix whose action never got its closing quote
+        """
+        if self.held is not None:
+            self.release(False)
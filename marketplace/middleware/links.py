@@ -0,0 +1,160 @@
+"""
+Rewrites a page's absolute links in linear time.
+"""
+from marketplace.middleware.chunks import splice
+
+START, ATTR, QUOTE = 'start', 'attr', 'quote'
+
+
+class LinkScan(object):
+    """
+    Where a LinkRewriter's scan of a page (or stream) has got to
+    """
+
+    def __init__(self, pos=0):
+        super(LinkScan,self).__init__()
+        self.phase = START
+        self.pos = pos  # where to carry on looking
+        self.at = None  # while in QUOTE, where the prefix would go
+
+
+class LinkRewriter(object):
+    """
+Sticks a prefix onto the absolute links in a tag's attribute (an <a>'s href,
+say), exactly as
+
+    re.sub(r'(<a\\s.*?)href="(/.*?)"', r'\\1href="PREFIX\\2"', page)
+
+would, but in one forward pass over the page.  That regex can take time
+quadratic in the length of a line, since from every '<a ' that doesn't end up
+matching it goes back over the rest of the line, which is just what a
+minified page full of in-page anchors and offsite links looks like.
+
+Only the spots where the prefix goes matter, since nothing else changes.
+From each tag (followed by whitespace) the regex finds the first attr="/ on
+the same line, and then the first quote after it on the same line.  If that
+quote isn't there, no later attr="/ on the line can have one either (each
+brings its own quote along), so neither that tag nor any other before the
+end of the line can match, and the scan skips to the line's end.  Every
+search only goes forward from where the last one stopped, so each stretch of
+the page gets looked at a bounded number of times.
+    """
+
+    WHITESPACE = ' \t\n\r\f\v'  # \s, for a str pattern
+
+    def __init__(self, tag, attr):
+        super(LinkRewriter,self).__init__()
+        self.tag = tag
+        self.needle = '%s="/' % attr
+        # enough of the end of one stream chunk to carry over to the next
+        self.keep = max(len(self.tag), len(self.needle) - 1)
+
+    def scan(self, content, end, state, final=True):
+        """
+        Yields where the prefix goes from state.pos up to end, leaving state
+        where the scan got to.  Unless final, the scan stops short of end
+        wherever what comes after end could still make a difference.
+        """
+        tag, needle = self.tag, self.needle
+        find = content.find
+        # the next needle, quote and newline at or after where the scan last
+        # looked for one (-1 for none before end), which only ever moves on
+        attr = quote = newline = -2
+        phase, pos = state.phase, state.pos
+        while True:
+            if phase == START:
+                start = find(tag, pos, end)
+                if start == -1:
+                    pos = end if final else max(pos, end - len(tag) + 1)
+                    break
+                space = start + len(tag)
+                if space >= end:
+                    pos = end if final else start
+                    break
+                if content[space] not in self.WHITESPACE:
+                    pos = start + 1
+                    continue
+                phase, pos = ATTR, space + 1
+
+            if newline != -1 and newline < pos:
+                newline = find('\n', pos, end)
+            if phase == ATTR:
+                if attr != -1 and attr < pos:
+                    attr = find(needle, pos, end)
+                if newline != -1 and (attr == -1 or newline < attr):
+                    phase, pos = START, newline - len(tag)
+                    continue
+                if attr == -1:
+                    pos = end if final else max(pos, end - len(needle) + 1)
+                    break
+                pos = attr + len(needle)
+                phase, state.at = QUOTE, pos - 1
+
+            if quote != -1 and quote < pos:
+                quote = find('"', pos, end)
+            if newline != -1 and (quote == -1 or newline < quote):
+                phase, pos = START, newline - len(tag)
+                continue
+            if quote == -1:
+                pos = end
+                break
+            yield state.at
+            phase, pos = START, quote + 1
+
+        state.phase, state.pos = phase, pos
+
+    def sub_range(self, content, start, end, prefix):
+        """
+        The rewritten content[start:end] as a list of chunks, or None if it
+        has no links to rewrite
+        """
+        points = list(self.scan(content, end, LinkScan(start)))
+        if not points:
+            return None
+        return splice(content, start, end, points, prefix)
+
+    def rewrite(self, chunks, prefix):
+        """
+        Yields the rewritten chunks of a stream.  Nothing is held back but a
+        few bytes at the end of each chunk, other than everything after a link
+        whose closing quote hasn't come along yet.
+        """
+        state = LinkScan()
+        behind = ''  # the end of the last chunk, already passed along
+        held = []  # everything since where a prefix might yet go
+        for chunk in chunks:
+            if not chunk:
+                continue
+            text = behind + chunk
+            emitted = len(behind)
+            out = []
+            for at in self.scan(text, len(text), state, final=False):
+                if at < emitted:  # a link from an earlier chunk came good
+                    out.append(prefix)
+                    out.extend(held)
+                else:
+                    out.extend(held)
+                    out.append(text[emitted:at])
+                    out.append(prefix)
+                    emitted = at
+                held = []
+            if state.phase == QUOTE and state.at >= emitted:
+                out.extend(held)
+                out.append(text[emitted:state.at])
+                held = [text[state.at:]]
+            elif state.phase == QUOTE:
+                held.append(text[emitted:])
+            else:
+                out.extend(held)
+                out.append(text[emitted:])
+                held = []
+            behind = text[-self.keep:]
+            shift = len(text) - len(behind)
+            state.pos -= shift
+            if state.phase == QUOTE:
+                state.at -= shift
+            if out:
+                yield ''.join(out)
+        # the stream's over, so a link still waiting on its quote never got it
+        if held:
+            yield ''.join(held)
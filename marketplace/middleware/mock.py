@@ -1,16 +1,23 @@
-from django.conf import settings
-#from django.http import QueryDict
+from django.http import QueryDict
 from django.core.exceptions import MiddlewareNotUsed
 import base64
-import hashlib
-import hmac
 import re
 import os
+import itertools
 
+from marketplace import conf
 from marketplace import logger
+from marketplace import stats
+from marketplace.middleware.compat import MiddlewareMixin
+from marketplace.middleware.hsml import HsmlRewriter
+from marketplace.middleware.streaming import (
+        is_streaming, get_chunks, set_chunks, read_through)
+from marketplace.middleware.pipeline import pipeline_for
+from marketplace.middleware import policy
+from marketplace.middleware import templates
 
 
-class MockMiddleware(object):
+class MockMiddleware(MiddlewareMixin):
     """
 Use this middleware to mock exactly what the HubSpot Marketplace would do with
 your requests/responses locally.  This allows you to test your app locally and
@@ -40,8 +47,32 @@ This middleware assumes that anything coming in on /market/HUBID/canvas/SLUG
 should seem as a marketplace request should seem, and it appropriately adds all
 the attributes to the request that would be added in production.
 
+To mock more than one app at once, list the others under 'apps', each with
+whatever settings differ from the top level ones (a different callback_url, at
+least, unless they're all served from the same place):
+
+    HUBSPOT_MARKETPLACE_MOCK = {
+        'slug': 'yourappslug',
+        'app': {'name': 'YourAppName', 'callback_url': 'http://localhost:8000'},
+        'apps': {
+            'yourotherslug': {
+                'app': {'name': 'YourOtherApp', 'callback_url': 'http://localhost:8000/other'},
+            },
+        },
+    }
+
+Each app's params, signature (with the secrets of whichever app in the
+HUBSPOT_MARKETPLACE_AUTH settings its callback path is on -- see SecretIndex)
+and callback path are worked out once, when the middleware is set up, and one
+regex picks out the canvas paths of all of them, so the per-request cost
+doesn't grow with the number of apps.
+
 It also rewrites all your hsml on the response as you would expect them
-rewritten in production.
+rewritten in production (just the pages, though -- see
+marketplace.middleware.policy for what counts).  Streamed (iterator-backed)
+responses stay streamed, though the page can't start going out until its
+</body> has been read, since the <hs:link>s and <hs:head>s anywhere in the
+body end up in the page's head.
 
 NOTE-- this mock will always have to play catchup with the marketplace.  As they
 add new features to the marketplace, they need to also be mocked here.  Please
@@ -60,52 +91,67 @@ feel free to contribute to this effort.
         'caller': 'Hubspot Marketplace',  # don't expect this overridden
     }
 
+    WRAPPER = 'mock.html'  # see marketplace.middleware.templates for skinning it
+    PLACEHOLDERS = ('HEAD_CONTENTS', 'BODY_CONTENTS', 'BOTTOM_BODY_CONTENTS')
+    REQUIRED_PLACEHOLDERS = ('BODY_CONTENTS',)
+
 
-    def __init__(self):
-        super(MockMiddleware,self).__init__()
-        mock = getattr(settings, 'HUBSPOT_MARKETPLACE_MOCK', {})
-        mock_safety = getattr(settings, 'HUBSPOT_MARKETPLACE_MOCK_SAFETY', None)
-        auth = getattr(settings, 'HUBSPOT_MARKETPLACE_AUTH', {})
-        secret = auth.get('secret_key')
+    def __init__(self, get_response=None):
+        super(MockMiddleware,self).__init__(get_response)
+        stats.configure()
+        config = conf.get()
+        mock = config.mock
+        mock_safety = config.mock_safety
+        self.secrets = config.secrets
         self.log = logger.get_log(__name__)
-        if not mock or mock and not secret or mock_safety and not os.environ.get(mock_safety):
+        if not mock or mock and not self.secrets or mock_safety and not os.environ.get(mock_safety):
             self.log.info(
                     'MockMiddleware has been turned off for all requests')
             raise MiddlewareNotUsed
-        payload = 'payload'
-        digest = hmac.new(secret, payload, hashlib.sha1).digest()
-        self.signature = '.'.join(
-                [self.base64_url_encode_for_real(s) 
-                    for s in [digest, payload]])
 
-        self.slug = mock.get('slug')
+        others = mock.get('apps') or {}
+        self.slug = mock.get('slug') or (others and sorted(others)[0])
         if not self.slug:
             raise KeyError("Missing slug definition in MockMiddleware")
 
-        self.prefix_path_re = re.compile('/market/(\d+)/canvas/%s'%self.slug)
-        self.body_re = re.compile(r'<body>(.*?)</body>',re.DOTALL)
-        self.head_re = re.compile(r'<hs:head>(.*?)</hs:head>',re.DOTALL)
-        self.link_re = re.compile(r'<hs:link (.*?)/?>')
-        self.script_re = re.compile(r'<hs:script(.*?)>(.*?)</hs:script>', re.DOTALL)
-        self.title_re = re.compile(r'<hs:title(.*?)>(.*?)</hs:title>')
-        self.form_re = re.compile(r'(<form\s.*?)action="(/.*?)"')
+        self.apps = {}
+        for slug, app in others.iteritems():
+            self.apps[slug] = self.build_app(slug, app, [mock])
+        if self.slug not in self.apps:
+            self.apps[self.slug] = self.build_app(self.slug, mock)
+        self.app = self.apps[self.slug]
+        self.signature = self.app.signature
+        self.base = self.app.base
+
+        # longest first, so the most specific slug wins
+        slugs = sorted(self.apps, key=lambda slug: (-len(slug), slug))
+        self.route_re = re.compile('/market/(\d+)/canvas/(%s)' %
+                                   '|'.join(re.escape(slug) for slug in slugs))
+        self.hsml = HsmlRewriter()
 
 # keeping this kicking around cuz we'll likely uncomment when marketplace fixes
 # how this works
 #        self.anchor_re = re.compile(r'(<a\s.*?)href="(/.*?)"')
 
-        path = os.path.join(os.path.dirname(__file__),'mock.html')
-        self.wrapper = open(path).read()
+        self.log.info('HubSpot Marketplace Mock Canvas Middleware Activated (%s)',
+                      ', '.join(sorted(self.apps)))
 
-        self.build_static_params(mock)
 
-        self.log.info('HubSpot Marketplace Mock Canvas Middleware Activated')
+    def build_app(self, slug, settings, parents=()):
+        """
+        Works out everything about mocking one app that doesn't depend on the
+        request
+        """
+        app = MockApp(slug, self.build_static_params(settings, None, parents))
+        app.signature = app.base['hubspot.marketplace.signature'] = self.sign('payload', app)
+        return app
 
 
-    def build_static_params(self, mock):
+    def build_static_params(self, mock, signature, parents=()):
         """
         Builds the params in a very forgiving way.  Necessary for backward
-        compatibility
+        compatibility.  Whatever mock leaves out is looked for in parents (the
+        top level settings, for one of the 'apps') before the defaults.
         """
 
         mapping = {
@@ -122,7 +168,7 @@ feel free to contribute to this effort.
         defaults = self.__class__.MOCK_SETTINGS_DEFAULTS
         for k,v in mapping.iteritems():
             val = None
-            for store in [mock, defaults]:
+            for store in [mock] + list(parents) + [defaults]:
                 if not val:
                     val = store.get(k) or store.get(v)
                     for l in [k,v]:
@@ -132,70 +178,44 @@ feel free to contribute to this effort.
                             val = val or temp.get(parts[1])
 
             base['hubspot.marketplace.%s'%k] = str(val or '')
-        base['hubspot.marketplace.signature'] = self.signature
+        base['hubspot.marketplace.signature'] = signature
         base['hubspot.marketplace.is_mock'] = 'true'
-        self.base = base
+        return base
 
 
+    @stats.timed('mock.process_request')
     def process_request(self, request):
-        url_match = self.prefix_path_re.match(request.path)
+        url_match = self.route_re.match(request.path)
         if not url_match: # this isn't a url that needs marketplace mocking
             return 
 
-        # make the relevant dictionary mutable
-        params = getattr(request, request.method).copy()
-
+        app = self.apps[url_match.group(2)]
         hub_id = int(url_match.group(1))
+        setattr(request, request.method, app.add_params(
+                getattr(request, request.method), hub_id, request.get_host(), request.path))
 
-        for k,v in self.base.iteritems():
-            params.appendlist(k,v)
-        params.appendlist('hubspot.marketplace.portal_id', str(hub_id))
-        params.appendlist('hubspot.marketplace.app.canvasUrl', 
-                "http://%s/market/%s/canvas/%s/" % 
-                (request.get_host(), hub_id, self.slug))
-        params.appendlist('hubspot.marketplace.app.pageUrl', str(request.path))
-
-        setattr(request, request.method, params)
-
-        callback_url = self.base['hubspot.marketplace.app.callbackUrl']
-        callback_path = (callback_url.split('//',1)+[''])[1] or callback_url
-        callback_prefix = (callback_path.split('/',1)+[''])[1]
-        callback_prefix = callback_prefix and '/%s'%callback_prefix
-
-        request.path = self.prefix_path_re.sub(callback_prefix, request.path, 1)
-        request.path_info = self.prefix_path_re.sub(callback_prefix, request.path_info, 1)
+        request.path = app.callback_prefix + request.path[url_match.end():]
+        info_match = self.route_re.search(request.path_info)
+        if info_match:
+            request.path_info = ''.join([request.path_info[:info_match.start()],
+                    self.apps[info_match.group(2)].callback_prefix,
+                    request.path_info[info_match.end():]])
 
 
+    @stats.timed('mock.process_response')
     def process_response(self, request, response):
         marketplace = request and getattr(request, 'marketplace', None)
-        if marketplace:
-            if self.body_re.search(response.content):
-                innards = self.body_re.findall(response.content)[0]
-                head = ''
-                for link in self.link_re.findall(innards):
-                    head += "\n<link %s />"%link
-                for head_content in self.head_re.findall(innards):
-                    head += "\n%s" % head_content
-                bottom = ''
-                for match_tuple in self.script_re.findall(innards):
-                    bottom += "\n<script%s>%s</script>" % (match_tuple[0], match_tuple[1])
-                innards = self.link_re.sub('',innards)
-                innards = self.head_re.sub('',innards)
-                innards = self.title_re.sub('',innards)
-                innards = self.script_re.sub('',innards)
-                innards = self.form_re.sub(r'\1action="/market/%s/canvas/%s\2"' %
-                        (marketplace.hub_id,self.slug), innards)
-
-    # keeping this kicking around cuz we'll likely uncomment when marketplace fixes
-    # how this works
-                    #innards = self.anchor_re.sub(r'\1href="/market/%s/canvas/%s\2"' %
-                            #(marketplace.hub_id,self.slug), innards)
-
-                content = self.wrapper
-                content = content.replace('[[HEAD_CONTENTS]]',head)
-                content = content.replace('[[BODY_CONTENTS]]',innards)
-                content = content.replace('[[BOTTOM_BODY_CONTENTS]]',bottom)
-                response.content = content
+        if marketplace and policy.rewritable(request, response):
+            form_prefix = '/market/%s/canvas/%s' % (marketplace.hub_id,
+                                                    self.app_for(marketplace).slug)
+            wrapper = self.wrapper()
+            if is_streaming(response):
+                set_chunks(response, self.stream_response(
+                        get_chunks(response), form_prefix, wrapper))
+                return response
+            pipeline_for(response).add(
+                    lambda document: self.rewrite_document(document, form_prefix, wrapper),
+                    ('mock', form_prefix, wrapper.version))
             #else:
 ##                print vars(response).keys()
                 #head_style_re = re.compile(
@@ -223,6 +243,96 @@ feel free to contribute to this effort.
 
 
 
+    def rewrite_document(self, document, form_prefix, wrapper=None):
+        """
+        Swaps the page for the wrapper with the page's rewritten body in it
+        """
+        if not document.find_body():
+            return
+        content, start, end = document.body_range()
+        head, innards, bottom = self.hsml.rewrite_body(
+                content, start, end, form_prefix)
+
+    # keeping this kicking around cuz we'll likely uncomment when marketplace fixes
+    # how this works
+            #innards = self.anchor_re.sub(r'\1href="/market/%s/canvas/%s\2"' %
+                    #(marketplace.hub_id,self.slug), innards)
+
+        document.replace(self.wrap(head, innards, bottom, wrapper))
+
+
+    def stream_response(self, chunks, form_prefix, wrapper=None):
+        """
+        Yields the rewritten page once the body has been read off of chunks.
+        Whatever comes after the body gets dropped, just like it does for
+        regular responses.
+        """
+        content = read_through(chunks, self.hsml.BODY_START)
+        start = content.find(self.hsml.BODY_START)
+        if start != -1:
+            content = read_through(chunks, self.hsml.BODY_END, content, start)
+        rewritten = self.hsml.rewrite(content, form_prefix)
+        if rewritten:
+            head, innards, bottom = rewritten
+            parts = self.wrap(head, innards, bottom, wrapper)
+        else:
+            parts = itertools.chain([content], chunks)
+        for part in parts:
+            yield part
+
+
+    def wrap(self, head, innards, bottom, wrapper=None):
+        """
+        Returns the wrapper's pieces with the page's pieces (the body as a
+        list of chunks) slotted in
+        """
+        wrapper = wrapper or self.wrapper()
+        return wrapper.render({
+            'HEAD_CONTENTS': head,
+            'BODY_CONTENTS': innards,
+            'BOTTOM_BODY_CONTENTS': bottom,
+        })
+
+
+    def wrapper(self):
+        """
+        The compiled wrapper
+        """
+        return templates.get(self.WRAPPER, self.PLACEHOLDERS, self.REQUIRED_PLACEHOLDERS)
+
+
+    def app_for(self, marketplace):
+        """
+        The app being mocked that a marketplace request's canvas url names,
+        or the main one if it doesn't name one of them
+        """
+        match = self.route_re.search(getattr(marketplace, 'base_url', None) or '')
+        return match and self.apps[match.group(2)] or self.app
+
+
+    def marketplace_params(self, hub_id, host, path, base=None, app=None):
+        """
+        The hubspot.marketplace.* params the marketplace adds to a request for
+        path on hub_id's canvas of app (the main one, unless given), as a list
+        of (key, value) pairs
+        """
+        return (app or self.app).marketplace_params(hub_id, host, path, base)
+
+
+    def sign(self, payload, app=None):
+        """
+        Signs payload the way the marketplace would, with the current secret
+        the AuthMiddleware will check requests on the app's (the main one,
+        unless given) callback path against
+        """
+        app = app or self.app
+        slug = self.secrets.slug_for_path(app.callback_prefix or '/')
+        digest = self.secrets.sign(payload, slug) or ''
+        return '.'.join(
+                [self.base64_url_encode_for_real(s) 
+                    for s in [digest, payload]])
+
+
     def base64_url_encode_for_real(self, decoded_s):
         """
         base64 library decided to leave '=' chars still kicking around, and was
@@ -233,6 +343,60 @@ feel free to contribute to this effort.
         return base64.urlsafe_b64encode(decoded_s).split('=',1)[0]
 
 
+class MockApp(object):
+    """
+    One of the apps being mocked, with its params (also kept as unicode, the
+    way a QueryDict keeps them, for each encoding that's come up) and the
+    local path its canvas maps onto worked out ahead of time
+    """
 
+    PORTAL_ID_KEY = u'hubspot.marketplace.portal_id'
+    CANVAS_URL_KEY = u'hubspot.marketplace.app.canvasUrl'
+    PAGE_URL_KEY = u'hubspot.marketplace.app.pageUrl'
 
+    def __init__(self, slug, base):
+        super(MockApp,self).__init__()
+        self.slug = slug
+        self.base = base
+        self.signature = base['hubspot.marketplace.signature']
+        self.canvas_url = 'http://%%s/market/%%s/canvas/%s/' % slug
+        self.decoded = {}  # encoding -> base.items() as unicode
+
+        callback_url = base['hubspot.marketplace.app.callbackUrl']
+        callback_path = (callback_url.split('//',1)+[''])[1] or callback_url
+        callback_prefix = (callback_path.split('/',1)+[''])[1]
+        self.callback_prefix = callback_prefix and '/%s'%callback_prefix
 
+    def marketplace_params(self, hub_id, host, path, base=None):
+        params = (base or self.base).items()
+        params.append(('hubspot.marketplace.portal_id', str(hub_id)))
+        params.append(('hubspot.marketplace.app.canvasUrl', self.canvas_url % (host, hub_id)))
+        params.append(('hubspot.marketplace.app.pageUrl', str(path)))
+        return params
+
+    def add_params(self, original, hub_id, host, path):
+        """
+        A mutable copy of the original QueryDict with the params added.  Only
+        the value lists get copied (the values themselves can't change), and
+        the params are added already decoded, which is all that
+        original.copy() and appendlist() would do, only a lot slower.
+        """
+        encoding = original.encoding
+        decoded = self.decoded.get(encoding)
+        if decoded is None:
+            decoded = self.decoded[encoding] = [
+                    (unicode(k, encoding, 'replace'), unicode(v, encoding, 'replace'))
+                    for k, v in self.base.iteritems()]
+        params = QueryDict('', mutable=True, encoding=encoding)
+        for key, values in dict.iteritems(original):
+            dict.__setitem__(params, key, list(values))
+        for key, value in decoded:
+            values = dict.get(params, key)
+            if values is None:
+                dict.__setitem__(params, key, [value])
+            else:
+                values.append(value)
+        params.appendlist(self.PORTAL_ID_KEY, str(hub_id))
+        params.appendlist(self.CANVAS_URL_KEY, self.canvas_url % (host, hub_id))
+        params.appendlist(self.PAGE_URL_KEY, str(path))
+        return params
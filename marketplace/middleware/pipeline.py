@@ -0,0 +1,257 @@
+"""
+A response rewrite pipeline shared by the rewriting middlewares.
+
+Instead of each middleware reading response.content, rewriting it and writing
+it back, each one registers a transform on the response's pipeline.  The
+transforms all run against the same Document the first time anything reads
+the response's content (usually the server sending it), so the page gets
+located once and joined back together once, no matter how many rewriting
+middlewares are stacked up.  That's after every middleware has handed the
+response on, so a transform that blows up gets logged (and counted as
+pipeline.errors) and the page goes out unrewritten.
+
+Since lots of pages come out the same for everybody on a portal, the results
+can be cached, keyed on a hash of the page plus what each transform was asked
+to do with it (its base_url, hub_id, slug...).  The cache is bounded by the
+bytes it holds rather than how many pages, and is off unless it's given a size
+in settings.py:
+
+    HUBSPOT_MARKETPLACE_REWRITE_CACHE = {
+        'max_bytes': 64 * 1024 * 1024,
+        'max_entries': 10000,  # optional
+    }
+
+Hits and misses are counted as pipeline.cache.hits and pipeline.cache.misses.
+"""
+import hashlib
+import threading
+
+from marketplace import conf
+from marketplace import logger
+from marketplace import stats
+from marketplace.lru_cache import LRUCache
+
+
+class Document(object):
+    """
+A page being rewritten, kept as a list of pieces rather than one string so
+that transforms can replace parts of it without rebuilding the whole thing.
+
+Once find_body() has located the first <body>...</body>, the contents of the
+body are kept as their own pieces, between the pieces before them (ending
+with '<body>') and the pieces after them (starting with '</body>').  Until
+something needs them as pieces, though, the page stays the one string it came
+in as, with the body marked by offsets, so finding the body copies nothing.
+    """
+
+    BODY_START = '<body>'
+    BODY_END = '</body>'
+
+    def __init__(self, content):
+        super(Document,self).__init__()
+        self.pieces = [content]
+        self.span = None  # where the body's pieces start and end, once known
+        self.bounds = None  # where the body starts and ends in the unsplit page
+
+    def text(self):
+        return ''.join(self.pieces)
+
+    def find_body(self):
+        """
+        Finds the body's contents, returning False if there isn't a body
+        """
+        if self.span is None:
+            content = self.text()
+            self.pieces = [content]
+            start = content.find(self.BODY_START)
+            end = -1
+            if start != -1:
+                end = content.find(self.BODY_END, start)
+            if end == -1:
+                self.span = False
+            else:
+                self.bounds = (start + len(self.BODY_START), end)
+                self.span = (1, 2)
+        return bool(self.span)
+
+    def split(self):
+        """
+        Cuts the unsplit page up into the pieces before, in and after the body
+        """
+        if self.bounds is not None:
+            content = self.pieces[0]
+            start, end = self.bounds
+            self.pieces = [content[:start], content[start:end], content[end:]]
+            self.bounds = None
+
+    def regions(self):
+        """
+        The page as (string, start, end) ranges, one per piece, without
+        splitting it
+        """
+        if self.bounds is not None:
+            content = self.pieces[0]
+            start, end = self.bounds
+            return [(content, 0, start), (content, start, end), (content, end, len(content))]
+        return [(piece, 0, len(piece)) for piece in self.pieces]
+
+    def before(self):
+        self.split()
+        return self.pieces[:self.span[0]]
+
+    def body(self):
+        self.split()
+        return self.pieces[self.span[0]:self.span[1]]
+
+    def search_before(self, pattern):
+        """
+        Searches the part of the page before the body
+        """
+        if self.bounds is not None:
+            return pattern.search(self.pieces[0], 0, self.bounds[0])
+        return pattern.search(''.join(self.before()))
+
+    def body_range(self):
+        """
+        The body as a (string, start, end) range, only joining its pieces
+        into one string if they've been split up
+        """
+        if self.bounds is not None:
+            return (self.pieces[0],) + self.bounds
+        body = self.body()
+        if len(body) != 1:
+            body = [''.join(body)]
+            self.replace_body(body)  # so the pieces can go
+        return body[0], 0, len(body[0])
+
+    def replace_body(self, pieces):
+        self.split()
+        start, end = self.span
+        self.pieces[start:end] = pieces
+        self.span = (start, start + len(pieces))
+
+    def replace(self, pieces):
+        """
+        Replaces the whole page; the body will have to be found again
+        """
+        self.pieces = list(pieces)
+        self.span = None
+        self.bounds = None
+
+    def rewrite(self, rewrite_range):
+        """
+        Rewrites every piece, keeping the body where it is.  rewrite_range is
+        called with a (string, start, end) range at a time, and returns the
+        range's rewritten chunks, or None to leave it be.
+        """
+        regions = self.regions()
+        outputs = [rewrite_range(content, start, end) for content, start, end in regions]
+        if outputs.count(None) == len(outputs):
+            return  # nothing to change, so nothing to copy
+        for i, (content, start, end) in enumerate(regions):
+            if outputs[i] is None:
+                outputs[i] = [content[start:end]]
+        if self.span:
+            start, end = self.span
+            first = sum(len(output) for output in outputs[:start])
+            self.span = (first, first + sum(len(output) for output in outputs[start:end]))
+        self.pieces = [piece for output in outputs for piece in output]
+        self.bounds = None
+
+class RewritePipeline(object):
+    """
+Stands in for a response's content, running its transforms (in the order
+they were added) the first time the content is read.
+    """
+
+    def __init__(self, content):
+        super(RewritePipeline,self).__init__()
+        self.content = content
+        self.transforms = []
+        self.keys = []
+        self.pieces = None
+
+    def add(self, transform, key=None):
+        """
+        Adds a transform, with a key that sums up everything (other than the
+        page) its output depends on.  A pipeline with any transform that has
+        no key doesn't get cached.
+        """
+        self.transforms.append(transform)
+        self.keys.append(key)
+
+    def __iter__(self):
+        if self.pieces is None:
+            self.pieces = self.run()
+        return iter(self.pieces)
+
+    @stats.timed('pipeline.run')
+    def run(self):
+        cache = result_cache()
+        cache_key = None
+        if cache is not None and None not in self.keys:
+            cache_key = (hashlib.md5(self.content).digest(), len(self.content),
+                         tuple(self.keys))
+            cached = cache.get(cache_key)
+            if cached is not None:
+                stats.incr('pipeline.cache.hits')
+                self.content = None
+                return [cached]
+            stats.incr('pipeline.cache.misses')
+
+        try:
+            document = Document(self.content)
+            for transform in self.transforms:
+                transform(document)
+        except Exception:
+            # by now the response is on its way out, past anything django
+            # could do about it, so it goes out as it came in
+            logger.get_log(__name__).exception('could not rewrite the response')
+            stats.incr('pipeline.errors')
+            content, self.content = self.content, None
+            return [content]
+        pieces = [piece for piece in document.pieces if piece]
+        if cache_key is not None:
+            pieces = [''.join(pieces)]
+            cache.set(cache_key, pieces[0])
+        if stats.sink is not None:
+            stats.rewrote('pipeline', len(self.content), sum(len(piece) for piece in pieces))
+        self.content = None
+        return pieces
+
+
+_cache = (None, None)  # (settings snapshot, cache)
+_cache_lock = threading.Lock()
+
+
+def result_cache():
+    """
+    The rewrite result cache, or None if it's turned off
+    """
+    global _cache
+    config = conf.get()
+    snapshot, cache = _cache
+    if snapshot is not config:
+        with _cache_lock:
+            snapshot, cache = _cache
+            if snapshot is not config:
+                options = config.rewrite_cache
+                cache = None
+                if options.get('max_bytes'):
+                    cache = LRUCache(options.get('max_entries', 10000),
+                                     max_bytes=options['max_bytes'])
+                _cache = (config, cache)
+    return cache
+
+
+def pipeline_for(response):
+    """
+    Returns the response's pipeline, setting one up if it doesn't have one
+    that's still open to more transforms
+    """
+    container = response._container
+    if isinstance(container, RewritePipeline) and container.pieces is None:
+        return container
+    pipeline = RewritePipeline(response.content)
+    response._container = pipeline
+    return pipeline
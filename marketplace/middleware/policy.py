@@ -0,0 +1,145 @@
+"""
+Decides whether a response is one the rewriting middlewares should touch at
+all, from its headers alone, before anybody reads (let alone decodes) its
+content.
+"""
+import re
+import threading
+
+from marketplace import conf
+from marketplace import stats
+from marketplace.middleware.pipeline import RewritePipeline
+from marketplace.middleware.streaming import is_streaming
+
+
+class RewritePolicy(object):
+    """
+Only pages get rewritten: responses with an HTML content type, no content
+encoding (a gzipped body can't be rewritten), an ASCII compatible charset, a
+status that comes with a body, and no bigger than max_bytes (where that's
+known up front).  Paths can be left out (or, with include_paths, only some
+let in), either by prefix or, starting with a '^', by regex.  All of it can
+be changed in settings.py:
+
+    HUBSPOT_MARKETPLACE_REWRITE = {
+        'content_types': ['text/html', 'application/xhtml+xml'],
+        'max_bytes': 10 * 1024 * 1024,  # default: no limit
+        'include_paths': [],  # default: everything
+        'exclude_paths': ['/api/', '^/reports/\d+/csv'],
+    }
+
+Whatever gets turned away is counted as rewrite_policy.skipped.
+    """
+
+    CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+    NO_BODY_STATUSES = (204, 304)
+    WIDE_CHARSETS = ('utf-16', 'utf16', 'utf-32', 'utf32', 'ucs-2', 'ucs2')
+
+    def __init__(self, options):
+        super(RewritePolicy,self).__init__()
+        self.content_types = frozenset(t.lower() for t in
+                options.get('content_types', self.__class__.CONTENT_TYPES))
+        self.max_bytes = options.get('max_bytes')
+        self.include_re = self.compile_paths(options.get('include_paths'))
+        self.exclude_re = self.compile_paths(options.get('exclude_paths'))
+
+    def compile_paths(self, paths):
+        """
+        Rolls a list of path prefixes and regexes up into one regex, or None
+        """
+        if not paths:
+            return None
+        return re.compile('|'.join(
+                path.startswith('^') and '(?:%s)' % path or re.escape(path)
+                for path in paths))
+
+    def allows(self, request, response):
+        """
+        The verdict on the response, only worked out again if something it
+        was worked out from has changed since the last rewriting middleware
+        asked (some middleware in between swapping the content type, say)
+        """
+        key = self.key(response)
+        cached = getattr(response, '_marketplace_rewritable', None)
+        if cached is None or cached[0] != key:
+            cached = (key, self.check(request, response))
+            response._marketplace_rewritable = cached
+            if not cached[1]:
+                stats.incr('rewrite_policy.skipped')
+        return cached[1]
+
+    def key(self, response):
+        """
+        What the verdict on the response depends on (other than its request's
+        path, which doesn't change on the way out)
+        """
+        return (self, response.status_code, response.get('Content-Type', None),
+                response.get('Content-Encoding', None), is_streaming(response),
+                self.max_bytes is not None and self.size(response))
+
+    def check(self, request, response):
+        status = response.status_code
+        if status < 200 or status in self.__class__.NO_BODY_STATUSES:
+            return False
+        if response.has_header('Content-Encoding') and \
+                response['Content-Encoding'].strip().lower() != 'identity':
+            return False
+        if response.has_header('Content-Type'):
+            params = response['Content-Type'].lower().split(';')
+            if params[0].strip() not in self.content_types:
+                return False
+            for param in params[1:]:
+                name, _, value = param.partition('=')
+                if name.strip() == 'charset' and \
+                        value.strip(' "\'').startswith(self.__class__.WIDE_CHARSETS):
+                    return False
+        if self.max_bytes is not None and self.size(response) > self.max_bytes:
+            return False
+        path = getattr(request, 'path', '')
+        if self.exclude_re is not None and self.exclude_re.match(path):
+            return False
+        if self.include_re is not None and not self.include_re.match(path):
+            return False
+        return True
+
+    def size(self, response):
+        """
+        The response's size in bytes, as far as it can be told without reading
+        it (0 for a stream that didn't say)
+        """
+        if response.has_header('Content-Length'):
+            try:
+                return int(response['Content-Length'])
+            except ValueError:
+                pass
+        container = getattr(response, '_container', None)
+        if isinstance(container, RewritePipeline):
+            if container.content is not None:
+                return len(container.content)
+        elif getattr(response, '_is_string', False):
+            return sum(len(piece) for piece in container)
+        return 0
+
+
+_policy = (None, None)  # (settings snapshot, policy)
+_policy_lock = threading.Lock()
+
+
+def current():
+    """
+    The policy for the current settings
+    """
+    global _policy
+    config = conf.get()
+    snapshot, policy = _policy
+    if snapshot is not config:
+        with _policy_lock:
+            snapshot, policy = _policy
+            if snapshot is not config:
+                policy = RewritePolicy(config.rewrite)
+                _policy = (config, policy)
+    return policy
+
+
+def rewritable(request, response):
+    return current().allows(request, response)
@@ -0,0 +1,41 @@
+"""
+Helpers for scanning a page in a single forward pass.
+"""
+
+
+class NextFinder(object):
+    """
+Finds the next occurrence of a string in content[:end] as a scan moves
+forward through it, remembering each answer until the scan passes it.
+
+A scan that asks for the next '>' (say) from each of a long run of tags that
+turn out not to have one then only searches that stretch of the page once,
+rather than once per tag -- which is all it takes for something like
+re.findall(r'<hs:link (.*?)/?>', page) to go quadratic on the wrong page.
+    """
+
+    def __init__(self, content, end=None):
+        super(NextFinder,self).__init__()
+        self.content = content
+        self.end = len(content) if end is None else end
+        self.found = {}  # string -> (searched from, found at)
+
+    def find(self, s, pos):
+        """
+        Like content.find(s, pos, end)
+        """
+        cached = self.found.get(s)
+        if cached is not None:
+            since, at = cached
+            if since <= pos and (at == -1 or at >= pos):
+                return at
+        at = self.content.find(s, pos, self.end)
+        self.found[s] = (pos, at)
+        return at
+
+    def in_line(self, since, at):
+        """
+        True if no newline comes between since and at (which mustn't be -1)
+        """
+        newline = self.find('\n', since)
+        return newline == -1 or newline > at
@@ -0,0 +1,79 @@
+"""
+Helpers for rewriting iterator-backed responses a chunk at a time, so the
+rewriting middlewares don't have to buffer (or break) a streamed response.
+"""
+
+
+def is_streaming(response):
+    """
+    True if the response content comes from an iterator instead of a string
+    """
+    return (getattr(response, 'streaming', False) or
+            not getattr(response, '_is_string', True))
+
+
+def get_chunks(response):
+    """
+    Returns an iterator over the response's content as encoded strings,
+    without consuming it
+    """
+    if getattr(response, 'streaming', False):
+        return iter(response.streaming_content)
+    charset = getattr(response, '_charset', 'utf-8')
+    return (isinstance(chunk, unicode) and chunk.encode(charset) or chunk
+            for chunk in response._container)
+
+
+def set_chunks(response, chunks):
+    """
+    Swaps the response's content for the (rewritten) chunks iterator.  The
+    length is no longer known up front, so any Content-Length goes away.
+    """
+    if getattr(response, 'streaming', False):
+        response.streaming_content = chunks
+    else:
+        response._container = chunks
+        response._is_string = False
+    if response.has_header('Content-Length'):
+        del response['Content-Length']
+
+
+def read_through(chunks, marker, read='', since=0):
+    """
+    Pulls chunks off the iterator until marker shows up somewhere after since,
+    returning everything read (including what was already read).  If the
+    iterator runs dry first, everything is returned all the same.
+    """
+    if read.find(marker, since) != -1:
+        return read
+    parts = [read]
+    tail = read[max(since, len(read) - len(marker) + 1):]
+    for chunk in chunks:
+        parts.append(chunk)
+        if marker in tail + chunk:
+            break
+        tail = (tail + chunk)[-(len(marker) - 1):]
+    return ''.join(parts)
+
+
+def insert_before(chunks, marker, text):
+    """
+    Passes the chunks through, slipping text in right before the first
+    occurrence of marker (even if marker is split across chunks)
+    """
+    held = ''
+    for chunk in chunks:
+        held += chunk
+        at = held.find(marker)
+        if at != -1:
+            yield held[:at]
+            yield text
+            yield held[at:]
+            for chunk in chunks:
+                yield chunk
+            return
+        keep = len(marker) - 1
+        if len(held) > keep:
+            yield held[:-keep]
+            held = held[-keep:]
+    yield held
@@ -0,0 +1,209 @@
+"""
+The wrappers the rewriting middlewares dress pages up in (mock.html for the
+MockMiddleware, error_goggles.html and error_goggles_reset.css for the
+ErrorGogglesMiddleware), each compiled just once.
+
+    wrapper = templates.get('mock.html')
+    pieces = wrapper.render({'HEAD_CONTENTS': head, ...})
+
+Any of them can be skinned by putting a file of the same name in one of the
+directories listed in your settings.py, which are searched in order before
+the middlewares' own.  With 'reload' set, the files get checked for changes
+(no more often than every that many seconds), so a skin can be worked on
+without restarting:
+
+    HUBSPOT_MARKETPLACE_TEMPLATES = {
+        'dirs': ['/path/to/your/skins'],
+        'reload': 2,  # seconds
+    }
+
+Each middleware says which placeholders its templates can have, and which
+they have to, and a skin that doesn't fit (one with a typo in a placeholder,
+say) gets logged and passed over for the template it would have replaced,
+rather than breaking every page on its way out.
+
+Each template carries a version (a hash of what's in it), which the rewrite
+pipeline's cache keys include, so a reloaded skin never gets served from
+pages cached with the old one.
+"""
+import os
+import time
+import hashlib
+import threading
+
+from marketplace import conf
+from marketplace import logger
+from marketplace.lazy import lazy_re
+
+DEFAULT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_hole = object()  # marks where the page goes in Template.around
+
+
+class Template(object):
+    """
+A wrapper split around its [[PLACEHOLDERS]] once, into the fixed segments
+between them, so filling one in is a matter of handing back the segments with
+the values slotted in between -- a single join, if that -- rather than a
+str.replace per placeholder over the whole page.
+    """
+
+    placeholder_re = lazy_re(r'\[\[([A-Z_]+)\]\]')
+
+    def __init__(self, segments, names):
+        super(Template,self).__init__()
+        self.segments = segments  # one more than there are names
+        self.names = names
+        self.version = hashlib.md5('\0'.join(
+                [segment for pair in zip(segments, names + ['']) for segment in pair])).hexdigest()
+
+    @classmethod
+    def compile(cls, text):
+        parts = cls.placeholder_re.split(text)
+        return cls(parts[0::2], parts[1::2])
+
+    def check(self, expected, required=()):
+        """
+        What's wrong with the template's placeholders, if it has any that
+        aren't expected or is missing any that are required, or None
+        """
+        problems = []
+        unexpected = sorted(set(name for name in self.names if name not in expected))
+        if unexpected:
+            problems.append('unexpected %s' % ', '.join(unexpected))
+        missing = [name for name in required if name not in self.names]
+        if missing:
+            problems.append('missing %s' % ', '.join(missing))
+        return problems and ' and '.join(problems) or None
+
+    def render(self, values):
+        """
+        The filled in template as a list of pieces.  Each value can be a
+        string or a list of chunks, and every placeholder needs one.
+        """
+        segments = self.segments
+        pieces = segments[0] and [segments[0]] or []
+        for i, name in enumerate(self.names):
+            value = values[name]
+            if isinstance(value, list):
+                pieces.extend(value)
+            else:
+                pieces.append(value)
+            if segments[i + 1]:
+                pieces.append(segments[i + 1])
+        return pieces
+
+    def around(self, name, values):
+        """
+        The pieces that go before and after the (first) placeholder called
+        name, as a (before, after) tuple, for wrapping a page that's still
+        streaming
+        """
+        values = dict(values)
+        values[name] = _hole
+        pieces = self.render(values)
+        at = pieces.index(_hole)
+        return pieces[:at], [piece for piece in pieces[at + 1:] if piece is not _hole]
+
+    def fill(self, values):
+        """
+        A template with the placeholders in values filled in for good (each
+        value a string), and the rest left as they are
+        """
+        segments, names = [self.segments[0]], []
+        for i, name in enumerate(self.names):
+            if name in values:
+                segments[-1] += values[name] + self.segments[i + 1]
+            else:
+                names.append(name)
+                segments.append(self.segments[i + 1])
+        return Template(segments, names)
+
+
+class TemplateLibrary(object):
+    """
+    Finds, compiles and hands out templates by file name, looking through
+    dirs before the middlewares' own directory.  Each is compiled the first
+    time it's asked for and then, if reload is set, checked for changes (or
+    for a skin that's turned up) once reload seconds have passed.
+    """
+
+    def __init__(self, dirs=(), reload=None, clock=time.time):
+        super(TemplateLibrary,self).__init__()
+        self.dirs = list(dirs) + [DEFAULT_DIR]
+        self.reload = reload
+        self.clock = clock
+        self.loaded = {}  # name -> (template, (path, mtime, size), when to check it next)
+        self.lock = threading.Lock()
+
+    def get(self, name, expected=None, required=()):
+        """
+        The template called name.  If expected is given, a template with any
+        other placeholders, or without all the required ones, is passed over
+        for the one loaded before it (or the middlewares' own).
+        """
+        entry = self.loaded.get(name)
+        if entry is not None and (self.reload is None or self.clock() < entry[2]):
+            return entry[0]
+        with self.lock:
+            entry = self.loaded.get(name)
+            if entry is not None and (self.reload is None or self.clock() < entry[2]):
+                return entry[0]  # another thread just loaded it
+            path = self.find(name)
+            stamp = self.stamp(path)
+            if entry is not None and entry[1] == stamp:
+                template = entry[0]
+            else:
+                template = self.compile(path)
+                problem = expected is not None and template.check(expected, required)
+                if problem:
+                    logger.get_log(__name__).error('not using %s (%s placeholders)', path, problem)
+                    if entry is not None:
+                        template = entry[0]
+                    else:
+                        template = self.compile(os.path.join(DEFAULT_DIR, name))
+            self.loaded[name] = (template, stamp, self.reload is not None and self.clock() + self.reload)
+            return template
+
+    def stamp(self, path):
+        stat = os.stat(path)
+        return (path, stat.st_mtime, stat.st_size)
+
+    def compile(self, path):
+        with open(path, 'rb') as f:
+            return Template.compile(f.read())
+
+    def find(self, name):
+        for directory in self.dirs:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return path
+        raise IOError('no template called %s in %s' % (name, ', '.join(self.dirs)))
+
+
+_library = (None, None)  # (settings snapshot, library)
+_lock = threading.Lock()
+
+
+def library():
+    """
+    The template library, set up from the current settings
+    """
+    global _library
+    config = conf.get()
+    snapshot, templates = _library
+    if snapshot is not config:
+        with _lock:
+            snapshot, templates = _library
+            if snapshot is not config:
+                options = config.templates
+                templates = TemplateLibrary(options.get('dirs', ()), options.get('reload'))
+                _library = (config, templates)
+    return templates
+
+
+def get(name, expected=None, required=()):
+    """
+    The compiled template called name (see TemplateLibrary.get)
+    """
+    return library().get(name, expected, required)
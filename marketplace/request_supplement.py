@@ -7,29 +7,82 @@ class RequestSupplement(object):
     # more understandable naming in some cases.  You're free to use whichever
     # you want.
 
-    EXTRAS = { 
+    EXTRAS = {
         'portal_id': 'hub_id',
         'app_pageUrl': 'local_url',
         'app_callbackUrl': 'local_base_url',
         'app_canvasUrl': 'base_url',
     }
+    ALIASES = dict((v, k) for k, v in EXTRAS.iteritems())
 
-    def __init__(self, request):
+    PREFIX = 'hubspot.marketplace.'
+
+    # the hubspot.marketplace.* params are only indexed when an attribute is
+    # first asked for, and each one only gets converted when it's asked for,
+    # so views that read a single attribute don't pay for all of them
+    __slots__ = ('_request', '_index', '_values')
+
+    def __init__(self, request, params=None):
         super(RequestSupplement,self).__init__()
-        self.process(request)
-
-    def process(self, request):
-        for k in request.REQUEST:
-            if k.startswith('hubspot.marketplace.'):
-                attr = '_'.join(k.split('.')[2:])
-                val = request.REQUEST.get(k)
-                if attr.endswith('_id'):
-                    val = long(val)
-                elif attr.startswith('is_'):
-                    val = val.lower()=='true'
-                setattr(self, attr, val)
-        for k in self.__class__.EXTRAS:
-            if getattr(self,k,None): # they're not all necessarily here (uninstall hook only gives secret and portal_id)
-                setattr(self,self.__class__.EXTRAS[k],getattr(self,k))
+        index = None
+        if params is not None:
+            index, request = self.index_params(params), None
+        object.__setattr__(self, '_request', request)
+        object.__setattr__(self, '_index', index)
+        object.__setattr__(self, '_values', {})
+
+    @classmethod
+    def marketplace_params(cls, request):
+        """
+        Returns the raw hubspot.marketplace.* params on the request as a tuple
+        of (key, value) pairs
+        """
+        return tuple((k, request.REQUEST.get(k)) for k in request.REQUEST
+                     if k.startswith(cls.PREFIX))
+
+    def index_params(self, params):
+        """
+        Maps attribute names to their raw values
+        """
+        return dict(('_'.join(k.split('.')[2:]), val) for k, val in params)
+
+    def convert(self, attr, val):
+        if attr.endswith('_id'):
+            return long(val)
+        elif attr.startswith('is_'):
+            return val.lower()=='true'
+        return val
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        values = self._values
+        if attr in values:
+            return values[attr]
+        if self._index is None:
+            object.__setattr__(self, '_index', self.index_params(
+                self.__class__.marketplace_params(self._request)))
+            object.__setattr__(self, '_request', None)
+
+        # they're not all necessarily here (uninstall hook only gives secret
+        # and portal_id), and an empty one doesn't count
+        source = self.__class__.ALIASES.get(attr)
+        if source and source in self._index:
+            val = getattr(self, source)
+            if val:
+                return val
+        if attr not in self._index:
+            raise AttributeError(attr)
+        val = values[attr] = self.convert(attr, self._index[attr])
+        return val
+
+    def __setattr__(self, attr, val):
+        self._values[attr] = val
 
+    def __copy__(self):
+        other = object.__new__(self.__class__)
+        object.__setattr__(other, '_request', self._request)
+        object.__setattr__(other, '_index', self._index)
+        object.__setattr__(other, '_values', dict(self._values))
+        return other
 
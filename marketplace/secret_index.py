@@ -0,0 +1,152 @@
+"""
+The marketplace secrets the AuthMiddleware checks signatures against
+"""
+import re
+import hmac
+import base64
+import hashlib
+
+
+class SecretIndex(object):
+    """
+Holds every app's secrets -- its current one first, then any previous ones
+still being honored while a rotation goes out -- as keyed HMAC state that's
+built once and copied for each check.  Apps are indexed by slug, and each one
+is served from its own path in your project, which is how a request gets
+matched up with its app: it's checked against the secrets of the app whose
+path it's on, and requests on none of them against the default secrets (the
+top level secret_key), if there are any.  Nothing the request says about
+itself (its canvas url, say) gets a say in which secrets it's checked against.
+
+Takes the HUBSPOT_MARKETPLACE_AUTH settings:
+
+    HUBSPOT_MARKETPLACE_AUTH = {
+        'secret_key': 'default-secret-key',
+        'previous_secret_keys': ['retiring-secret-key'],
+        'apps': {
+            'yourappslug': {
+                'secret_key': 'yourappslug-secret-key',
+                'previous_secret_keys': [],
+                'path': '/yourapp/',
+            },
+            'yourotherslug': {
+                'secret_key': 'yourotherslug-secret-key',
+                'path': '/other/',
+            },
+        },
+    }
+
+An app without a path can still be signed for, or checked against, by its
+slug (by the bulk verifier, say), but no request gets routed to it.  A slug
+that isn't listed has no secrets at all; it doesn't fall back to the default
+ones.
+    """
+
+    def __init__(self, auth):
+        super(SecretIndex,self).__init__()
+        self.default = self.build_keys(auth)
+        self.apps = {}
+        self.unrouted = []  # slugs of the apps without a path
+        paths = []
+        for slug, app in auth.get('apps', {}).iteritems():
+            if isinstance(app, basestring):
+                app = {'secret_key': app}
+            keys = self.build_keys(app)
+            if keys:
+                self.apps[slug] = keys
+                if app.get('path') is not None:
+                    paths.append((app['path'].rstrip('/'), slug))
+                else:
+                    self.unrouted.append(slug)
+        self.unrouted.sort()
+
+        # longest first, so the most specific path wins
+        paths.sort(key=lambda path: (-len(path[0]), path[1]))
+        self.path_slugs = [slug for path, slug in paths]
+        self.path_re = None
+        if paths:
+            self.path_re = re.compile('|'.join(
+                    '(%s(?=/|$))' % re.escape(path) for path, slug in paths))
+
+    def __len__(self):
+        return len(self.apps) + (self.default and 1 or 0)
+
+    def build_keys(self, conf):
+        """
+        Keyed HMAC state for the current secret and then the previous ones
+        """
+        secrets = [conf.get('secret_key')] + list(conf.get('previous_secret_keys') or [])
+        return [hmac.new(str(secret), digestmod=hashlib.sha1)
+                for secret in secrets if secret]
+
+    def slug_for(self, request):
+        """
+        The slug of the app whose path the request is on, or None
+        """
+        return self.slug_for_path(request.path_info or request.path)
+
+    def slug_for_path(self, path):
+        """
+        The slug of the app whose path path is on, or None
+        """
+        if self.path_re is None:
+            return None
+        match = self.path_re.match(path)
+        return match and self.path_slugs[match.lastindex - 1] or None
+
+    def keys_for(self, slug):
+        """
+        The slug's keys, the default ones for a slug of None, and none at all
+        for a slug that isn't listed
+        """
+        if slug is None:
+            return self.default
+        return self.apps.get(slug, [])
+
+    def sign(self, payload, slug=None, key=0):
+        """
+        The digest of payload under the slug's current key (or the key-th
+        previous one), or None if there's no such key
+        """
+        keys = self.keys_for(slug)
+        if key >= len(keys):
+            return None
+        mac = keys[key].copy()
+        mac.update(payload)
+        return mac.digest()
+
+    def verify(self, signature, slug=None):
+        """
+        Checks a marketplace signature (the base64 of its digest, a '.', and
+        the base64 of its payload), returning the index of the slug's key that
+        signed it, or None.  Raises TypeError if it isn't base64.
+        """
+        digest, payload = [base64_url_decode_for_real(s)
+                           for s in (signature+'.').split('.')[0:2]]
+        if not digest or not payload:
+            return None
+        return self.match(digest, payload, slug)
+
+    def match(self, digest, payload, slug=None):
+        """
+        Returns the index of the slug's key (0 for the current one) that
+        signed payload to digest, or None if none of them did
+        """
+        # not imported up top, so signing doesn't need django loaded
+        from django.utils.crypto import constant_time_compare
+        for i, key in enumerate(self.keys_for(slug)):
+            mac = key.copy()
+            mac.update(payload)
+            if constant_time_compare(digest, mac.digest()):
+                return i
+        return None
+
+
+def base64_url_decode_for_real(encoded_s):
+    """
+    base64 library decided to leave '=' chars still kicking around, and was
+    still bold enough to call their method 'urlsafe' -- okaaaaay...  This
+    method is urlsafe for real, and matches what the marketplace is
+    expecting
+    """
+    return base64.urlsafe_b64decode(encoded_s + '=' * (4 - len(encoded_s) % 4))
@@ -0,0 +1,70 @@
+"""
+Compact, self-verifying tokens that carry a request's marketplace params, so
+the requests a canvas page makes after it loads (AJAX calls and the like) can
+get their request.marketplace back without the marketplace signing them.
+
+A token is the base64 of a little JSON document (the params, the app's slug
+and when the token expires), a '.', and the base64 of its HMAC under the app's
+current secret.  Nothing gets stored server side.
+"""
+import time
+import json
+import base64
+
+from marketplace.secret_index import base64_url_decode_for_real
+
+
+class SessionTokens(object):
+    """
+    Issues and checks tokens against the secrets in a SecretIndex
+    """
+
+    # signed along with every token, so that nothing the marketplace signs
+    # can pass for a token (or the other way around)
+    PURPOSE = 'hubspot.marketplace.session:'
+    PREFIX = 'hubspot.marketplace.'  # left off the params' names in the token
+
+    def __init__(self, secrets, ttl):
+        super(SessionTokens,self).__init__()
+        self.secrets = secrets
+        self.ttl = ttl
+
+    def issue(self, params, slug=None, now=None):
+        """
+        A token for the (key, value) params that's good for ttl seconds
+        """
+        expires = int((now or time.time()) + self.ttl)
+        prefix = self.__class__.PREFIX
+        params = [(k.startswith(prefix) and k[len(prefix):] or k, v) for k, v in params]
+        payload = self.encode(json.dumps(
+                {'e': expires, 's': slug, 'p': params}, separators=(',', ':')))
+        digest = self.secrets.sign(self.__class__.PURPOSE + payload, slug)
+        return '%s.%s' % (payload, self.encode(digest or ''))
+
+    def restore(self, token, slug=None, now=None):
+        """
+        Returns the (key, value) params and expiry time from a token, or None
+        if the token isn't one of ours, was issued for some other app than
+        slug's, or has expired
+        """
+        try:
+            payload, _, digest = str(token).partition('.')
+            digest = self.decode(digest)
+            data = json.loads(self.decode(payload))
+            if data['s'] != slug:
+                return None
+            if not digest or self.secrets.match(
+                    digest, self.__class__.PURPOSE + payload, slug) is None:
+                return None
+            if data['e'] <= (now or time.time()):
+                return None
+            prefix = self.__class__.PREFIX
+            return tuple((prefix + k, v) for k, v in data['p']), data['e']
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            return None  # not ascii, not base64, not json, or not ours
+
+    def encode(self, s):
+        return base64.urlsafe_b64encode(s).split('=', 1)[0]
+
+    def decode(self, s):
+        return base64_url_decode_for_real(s)
@@ -0,0 +1,188 @@
+"""
+Optional timing and counting for the marketplace middlewares.
+
+Turned off unless a sink is named in settings.py:
+
+    HUBSPOT_MARKETPLACE_STATS = {
+        'sink': 'marketplace.stats.MemorySink',
+    }
+
+A sink is anything with timing(name, seconds) and incr(name, count) methods.
+The MemorySink keeps per-process latency histograms and counters that the
+marketplace.views.stats_dump view can dump as text or JSON.  While it's off, every
+instrumented call costs one check of a module global.
+"""
+import threading
+import timeit
+import bisect
+from django.utils.importlib import import_module
+
+timer = timeit.default_timer
+
+# the sink everything gets reported to, or None while stats are turned off
+sink = None
+_configured = False
+_name = None  # the sink's dotted name
+
+
+def configure(force=False):
+    """
+    Sets up the sink named in the marketplace settings, once per process (or
+    again, if force), keeping the one already set up if it's the same
+    """
+    global sink, _configured, _name
+    if _configured and not force:
+        return sink
+    from marketplace import conf
+    name = conf.get().stats.get('sink')
+    if name != _name:
+        sink = None
+        if name:
+            module, attr = name.rsplit('.', 1)
+            sink = getattr(import_module(module), attr)()
+        _name = name
+    _configured = True
+    return sink
+
+
+def reset():
+    """
+    Sets the sink up again from the settings as they are now, if it had been
+    set up at all (see marketplace.conf.reset)
+    """
+    if _configured:
+        configure(force=True)
+
+
+def timed(name):
+    """
+    Decorator that reports how long each call takes as name
+    """
+    def _dec(func):
+        def _timed(*args, **kwargs):
+            if sink is None:
+                return func(*args, **kwargs)
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                sink.timing(name, timer() - start)
+        _timed.__name__ = func.__name__
+        _timed.__dict__ = func.__dict__
+        _timed.__doc__ = func.__doc__
+        return _timed
+    return _dec
+
+
+def incr(name, count=1):
+    if sink is not None:
+        sink.incr(name, count)
+
+
+def rewrote(name, bytes_in, bytes_out):
+    """
+    Reports a response rewrite and how many bytes went in and came out
+    """
+    if sink is not None:
+        sink.incr('%s.rewrites' % name, 1)
+        sink.incr('%s.bytes_in' % name, bytes_in)
+        sink.incr('%s.bytes_out' % name, bytes_out)
+
+
+class Histogram(object):
+    """
+    Latencies bucketed on fixed bounds (in seconds), plus a count and total
+    """
+
+    BOUNDS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+              0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+    def __init__(self):
+        super(Histogram,self).__init__()
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.buckets[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, p):
+        """
+        Upper bound of the bucket the p-th percentile falls in (None past the
+        last bound)
+        """
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = 0
+        for bound, n in zip(self.BOUNDS + [None], self.buckets):
+            seen += n
+            if seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.count and self.total / self.count or 0.0,
+            'p50': self.percentile(0.50),
+            'p99': self.percentile(0.99),
+            'buckets': dict(zip([str(b) for b in self.BOUNDS] + ['inf'], self.buckets)),
+        }
+
+
+class MemorySink(object):
+    """
+    Aggregates timings and counters in memory for the life of the process
+    """
+
+    def __init__(self):
+        super(MemorySink,self).__init__()
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+
+    def timing(self, name, seconds):
+        with self.lock:
+            histogram = self.timings.get(name)
+            if histogram is None:
+                histogram = self.timings[name] = Histogram()
+            histogram.add(seconds)
+
+    def incr(self, name, count=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def reset(self):
+        with self.lock:
+            self.timings = {}
+            self.counters = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'timings': dict((k, h.as_dict()) for k, h in self.timings.iteritems()),
+                'counters': dict(self.counters),
+            }
+
+    def dump(self):
+        """
+        Renders a snapshot as plain text
+        """
+        snapshot = self.snapshot()
+        lines = ['%-40s %8s %10s %10s %10s' % ('timing', 'count', 'mean ms', 'p50 ms', 'p99 ms')]
+        for name in sorted(snapshot['timings']):
+            t = snapshot['timings'][name]
+            lines.append('%-40s %8d %10.3f %10s %10s' % (name, t['count'], t['mean'] * 1000,
+                         _ms(t['p50']), _ms(t['p99'])))
+        lines.append('')
+        lines.append('%-40s %8s' % ('counter', 'value'))
+        for name in sorted(snapshot['counters']):
+            lines.append('%-40s %8d' % (name, snapshot['counters'][name]))
+        return '\n'.join(lines) + '\n'
+
+
+def _ms(bound):
+    return bound is None and '>10000' or '<=%g' % (bound * 1000)
@@ -0,0 +1,24 @@
+import json
+from django.http import HttpResponse, Http404
+from marketplace import stats
+
+"""
+Views that come along with the marketplace middlewares.  None of these are
+wired up for you -- add them to your urls.py (behind whatever protection you
+see fit) if you want them.
+"""
+
+
+def stats_dump(request):
+    """
+    Dumps the in-process middleware stats as plain text, or as JSON with
+    ?format=json.  Only works with a sink that keeps a snapshot (like the
+    MemorySink).
+    """
+    sink = stats.configure()
+    if not hasattr(sink, 'snapshot'):
+        raise Http404
+    if request.GET.get('format') == 'json':
+        return HttpResponse(json.dumps(sink.snapshot(), indent=2, sort_keys=True),
+                            content_type='application/json')
+    return HttpResponse(sink.dump(), content_type='text/plain')